@@ -0,0 +1,29 @@
+"""
+Times lucy_Hedgehog_method in production mode, and compares it with the validated reference mode
+where the latter is still affordable.
+
+Run from the repository root:
+    python -m benchmarks.bench_lucy [max_exponent] [max_debug_exponent]
+"""
+import sys
+import time
+
+from primes.prime_sums import lucy_Hedgehog_method
+
+
+def time_call(N : int, debug : bool) -> tuple[int, float]:
+    start = time.perf_counter()
+    result = lucy_Hedgehog_method(N, debug=debug)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    max_exponent = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    max_debug_exponent = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    print("{:>8} {:>10} {:>10} {:>30}".format("N", "mode", "seconds", "sum of primes"))
+    for exponent in range(6, max_exponent + 1):
+        modes = [False] + ([True] if exponent <= max_debug_exponent else [])
+        for debug in modes:
+            result, seconds = time_call(10**exponent, debug)
+            print("{:>8} {:>10} {:>10.3f} {:>30}".format("10^{}".format(exponent), "debug" if debug else "production", seconds, result))
@@ -0,0 +1,28 @@
+"""
+Compares the pure python and numpy sieve construction engines.
+
+Run from the repository root:
+    python -m benchmarks.bench_sieve [max_exponent]
+"""
+import sys
+import time
+
+from primes.primeSieve import PrimeSieve, np
+
+
+def time_construction(size : int, engine : str, layout : str = "spf") -> float:
+    start = time.perf_counter()
+    PrimeSieve(size, layout=layout, engine=engine)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    max_exponent = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    engines = ["python"] + (["numpy"] if np is not None else [])
+    if np is None:
+        print("numpy is not installed, only the python engine is timed")
+
+    print("{:>8} {:>8} {:>10}".format("size", "engine", "seconds"))
+    for exponent in range(6, max_exponent + 1):
+        for engine in engines:
+            print("{:>8} {:>8} {:>10.3f}".format("10^{}".format(exponent), engine, time_construction(10**exponent, engine)))
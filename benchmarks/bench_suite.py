@@ -0,0 +1,162 @@
+"""
+Reproducible benchmark suite of the package: times sieve construction, primality tests, prime search,
+factorization, prime counting and prime sums over a grid of sizes, measures the peak memory of every case
+and writes the results as JSON, which can be compared with the results of a previous run.
+
+Run from the repository root:
+    python -m benchmarks.bench_suite [--profile quick|full] [--output results.json]
+                                     [--compare baseline.json] [--tolerance 1.25] [--no-memory]
+
+With --compare the process exits with status 1 if any case got slower than tolerance times its baseline.
+"""
+from typing import Callable
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from primes.primeSieve import PrimeSieve, np
+from primes.primes_utils import check_prime, next_prime, nth_prime
+from primes.factorization import get_prime_factors
+from primes.pi_computations import pi_legendre, pi_meissel, pi_lucy_hedgehog
+from primes.prime_sums import lucy_Hedgehog_method
+
+# inputs are drawn from a fixed seed so every run measures the same work
+SEED = 2024
+
+# number of queries per call of the batched cases
+BATCH = 1000
+
+
+def sieve_construction(size : int) -> Callable:
+    return lambda: PrimeSieve(size)
+
+def check_prime_sieve(size : int) -> Callable:
+    prime_sieve = PrimeSieve(size)
+    values = random.Random(SEED).sample(range(size), BATCH)
+    return lambda: [check_prime(v, prime_sieve) for v in values]
+
+def check_prime_no_sieve(size : int) -> Callable:
+    values = [size + random.Random(SEED + i).randrange(size) for i in range(BATCH)]
+    return lambda: [check_prime(v) for v in values]
+
+def next_prime_no_sieve(size : int) -> Callable:
+    values = [size + random.Random(SEED + i).randrange(size) for i in range(BATCH // 10)]
+    return lambda: [next_prime(v) for v in values]
+
+def nth_prime_no_sieve(size : int) -> Callable:
+    return lambda: nth_prime(size)
+
+def factors_sieve(size : int) -> Callable:
+    prime_sieve = PrimeSieve(size)
+    values = random.Random(SEED).sample(range(2, size), BATCH)
+    return lambda: [get_prime_factors(v, prime_sieve) for v in values]
+
+def factors_no_sieve(size : int) -> Callable:
+    rng = random.Random(SEED)
+    values = [rng.randrange(size, 2 * size) for _ in range(BATCH // 10)]
+    return lambda: [get_prime_factors(v) for v in values]
+
+# name: (sizes of the quick profile, sizes of the full profile, setup returning the timed callable)
+CASES = {
+    "PrimeSieve":                 ([10**5, 10**6],        [10**5, 10**6, 10**7, 10**8],          sieve_construction),
+    "check_prime[sieve]":         ([10**6],               [10**6, 10**7],                        check_prime_sieve),
+    "check_prime[no sieve]":      ([10**9, 10**18],       [10**9, 10**12, 10**18, 10**30],       check_prime_no_sieve),
+    "next_prime":                 ([10**9, 10**18],       [10**9, 10**12, 10**18, 10**30],       next_prime_no_sieve),
+    "nth_prime":                  ([10**5, 10**7],        [10**5, 10**7, 10**8, 10**9, 10**10],  nth_prime_no_sieve),
+    "get_prime_factors[sieve]":   ([10**6],               [10**6, 10**7],                        factors_sieve),
+    "get_prime_factors[no sieve]":([10**9, 10**15],       [10**9, 10**12, 10**15, 10**18],       factors_no_sieve),
+    "pi_legendre":                ([10**6, 10**7],        [10**6, 10**7, 10**8, 10**9],          lambda N: lambda: pi_legendre(N)),
+    "pi_meissel":                 ([10**6, 10**8],        [10**6, 10**8, 10**10, 10**11],        lambda N: lambda: pi_meissel(N)),
+    "pi_lucy_hedgehog":           ([10**6, 10**8],        [10**6, 10**8, 10**10, 10**12],        lambda N: lambda: pi_lucy_hedgehog(N)),
+    "lucy_Hedgehog_method":       ([10**6, 10**8],        [10**6, 10**8, 10**10, 10**12],        lambda N: lambda: lucy_Hedgehog_method(N)),
+}
+PROFILES = ("quick", "full")
+
+
+def time_case(func : Callable, repeat : int) -> list[float]:
+    """Wall clock seconds of repeat calls of func"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peak_memory(func : Callable) -> int:
+    """Peak bytes allocated during one call of func, as traced by tracemalloc (numpy buffers included)"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(profile : str, repeat : int, memory : bool, selected : list[str] = None) -> dict:
+    results = []
+    for name, (quick, full, setup) in CASES.items():
+        if selected and name not in selected:
+            continue
+        for size in quick if profile == "quick" else full:
+            func = setup(size)
+            times = time_case(func, repeat)
+            result = {"case": name, "size": size, "seconds": min(times), "times": times}
+            if memory:
+                result["peak_bytes"] = peak_memory(func)
+            results.append(result)
+            print("{:<28} {:>8} {:>10.4f}s {:>12}".format(name, "10^{}".format(len(str(size)) - 1), min(times),
+                                                          "{:.1f} MiB".format(result["peak_bytes"] / 2**20) if memory else ""), flush=True)
+    return {
+        "metadata": {
+            "profile": profile,
+            "repeat": repeat,
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__ if np is not None else None,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare(report : dict, baseline : dict, tolerance : float) -> list[str]:
+    """Returns a description of every case of report slower than tolerance times the same case of baseline"""
+    previous = {(r["case"], r["size"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    for r in report["results"]:
+        before = previous.get((r["case"], r["size"]))
+        if before is not None and r["seconds"] > tolerance * before:
+            regressions.append("{} at {}: {:.4f}s, baseline {:.4f}s ({:.2f}x)".format(r["case"], r["size"], r["seconds"], before, r["seconds"] / before))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark suite of the primes package")
+    parser.add_argument("--profile", choices=PROFILES, default="quick", help="grid of sizes to run")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per case, the minimum is reported")
+    parser.add_argument("--case", action="append", choices=list(CASES), help="run only the given cases")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak memory measurement")
+    args = parser.parse_args()
+
+    report = run(args.profile, args.repeat, args.memory, args.case)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
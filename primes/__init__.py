@@ -1,4 +1,8 @@
-from .primes_utils import check_prime, next_prime, prime_list, nth_prime
+from .primes_utils import check_prime, check_prime_many, next_prime, prev_prime, prime_list, nth_prime
 from .primeSieve import PrimeSieve
-from .factorization import get_prime_factors, prime_factors_generator
-from .pi_computations import pi_brute, pi_legendre, pi_meissel, pi_lucy_hedgehog
\ No newline at end of file
+from .factorization import get_prime_factors, prime_factors_generator, factorize_range
+from .pi_computations import pi_brute, pi_legendre, pi_meissel, pi_lucy_hedgehog, pi_lehmer, pi_lmo, prime_pi
+from .segmented_sieve import primerange, iter_primes
+from .arithmetic_functions import arithmetic_tables, arithmetic_tables_range
+from .checkpoints import PrimeCheckpoints
+from .instrumentation import Stats, collect_stats
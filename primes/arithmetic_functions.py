@@ -0,0 +1,95 @@
+from array import array
+
+from .primeSieve import PrimeSieve
+from .factorization import factorize_range
+
+# names of the computed functions:
+#   phi   - Euler's totient
+#   mu    - Moebius function
+#   tau   - number of divisors
+#   sigma - sum of divisors
+#   omega - number of distinct prime factors
+FUNCTIONS = ("phi", "mu", "tau", "sigma", "omega")
+TYPECODES = {"phi": "Q", "mu": "b", "tau": "L", "sigma": "Q", "omega": "B"}
+
+
+def empty_tables(length : int) -> dict[str, array]:
+    return {f: array(TYPECODES[f], bytes(array(TYPECODES[f]).itemsize * length)) for f in FUNCTIONS}
+
+
+def arithmetic_tables(N : int) -> dict[str, array]:
+    """
+    Computes phi, mu, tau, sigma and omega of every n <= N in a single pass of a linear sieve.
+    Every composite is visited exactly once, as (smallest prime factor) * (cofactor).
+
+    Returns:
+        a dict mapping the function name to an array A with A[n] = f(n) for 1 <= n <= N (A[0] is 0)
+    """
+    T = empty_tables(N + 1)
+    phi, mu, tau, sigma, omega = (T[f] for f in FUNCTIONS)
+    if N < 1:
+        return T
+    phi[1], mu[1], tau[1], sigma[1] = 1, 1, 1, 1
+
+    lp = array("L", bytes(array("L").itemsize * (N + 1)))  # smallest prime factor
+    exp = array("B", bytes(N + 1))                          # exponent of the smallest prime factor
+    lpk = array("Q", bytes(8 * (N + 1)))                    # smallest prime factor raised to that exponent
+    primes = []
+
+    for i in range(2, N + 1):
+        if lp[i] == 0:
+            lp[i], exp[i], lpk[i] = i, 1, i
+            primes.append(i)
+            phi[i], mu[i], tau[i], sigma[i], omega[i] = i - 1, -1, 2, i + 1, 1
+
+        lp_i = lp[i]
+        for p in primes:
+            j = i * p
+            if p > lp_i or j > N:
+                break
+            lp[j] = p
+            if p == lp_i:
+                # p already divides i: only the power of p in the factorization grows
+                e, pk = exp[i] + 1, lpk[i] * p
+                exp[j], lpk[j] = e, pk
+                rest = i // lpk[i]
+                phi[j] = phi[i] * p
+                mu[j] = 0
+                tau[j] = tau[rest] * (e + 1)
+                sigma[j] = sigma[rest] * ((pk * p - 1) // (p - 1))
+                omega[j] = omega[i]
+            else:
+                # p is a new, smaller prime factor, so f(j) = f(p) * f(i)
+                exp[j], lpk[j] = 1, p
+                phi[j] = phi[i] * (p - 1)
+                mu[j] = -mu[i]
+                tau[j] = tau[i] * 2
+                sigma[j] = sigma[i] * (p + 1)
+                omega[j] = omega[i] + 1
+    return T
+
+
+def arithmetic_tables_range(lo : int, hi : int, prime_sieve : PrimeSieve = None) -> dict[str, array]:
+    """
+    Segmented variant of arithmetic_tables for lo <= n < hi (lo >= 1), computed from the block factorizations
+    of factorize_range, so only O(hi - lo) memory is used.
+
+    Returns:
+        a dict mapping the function name to an array A with A[i] = f(lo + i)
+    """
+    T = empty_tables(max(hi - lo, 0))
+    phi, mu, tau, sigma, omega = (T[f] for f in FUNCTIONS)
+    offsets, primes, exponents = factorize_range(lo, hi, prime_sieve)
+
+    for i in range(len(offsets) - 1):
+        f_phi, f_mu, f_tau, f_sigma = 1, 1, 1, 1
+        for k in range(offsets[i], offsets[i+1]):
+            p, e = primes[k], exponents[k]
+            pe = p ** e
+            f_phi *= pe - pe // p
+            f_mu = 0 if e > 1 else -f_mu
+            f_tau *= e + 1
+            f_sigma *= (pe * p - 1) // (p - 1)
+        phi[i], mu[i], tau[i], sigma[i] = f_phi, f_mu, f_tau, f_sigma
+        omega[i] = offsets[i+1] - offsets[i]
+    return T
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from array import array
+import math
+import struct
+import sys
+
+from . import parallel
+from .segmented_sieve import SEGMENT_SIZE, PARALLEL_BLOCKS, base_primes, sieve_task, count_and_sum_primes_in_range
+from .pi_computations import prime_pi
+from .prime_sums import prime_sum
+
+# default distance between two checkpoints, and number of exact results remembered by PrimeCheckpoints
+CHECKPOINT_STEP = 10**8
+CHECKPOINT_CACHE_SIZE = 1 << 12
+
+# checkpoint file format: magic, format version, step, number of checkpoints,
+# followed by the prime counts as little endian uint64 and the prime sums as 16 byte little endian ints
+CHECKPOINT_FILE_MAGIC = b"PRMCHKPT"
+CHECKPOINT_FILE_VERSION = 1
+CHECKPOINT_FILE_HEADER = struct.Struct("<8sHQQ")
+CHECKPOINT_SUM_BYTES = 16
+
+
+class PrimeCheckpoints:
+    """
+    Answers pi(x) and the sum of primes <= x from a table of both values at the checkpoints x = k * step,
+    corrected by a segmented sieve sweep of the numbers between x and the nearest checkpoint, at most step / 2 of them
+    below the last checkpoint and at most step past it.
+    Queries more than a step past the last checkpoint are passed on to prime_pi and prime_sum.
+    Exact results are kept in a bounded least recently used cache, as in pi_computations.LegendrePhi.
+    """
+    def __init__(self, upto : int, step : int = CHECKPOINT_STEP, *, workers : int = None, cache_size : int = CHECKPOINT_CACHE_SIZE):
+        """Builds the checkpoints up to upto in one sweep of the segmented sieve, split over workers processes if given"""
+        if step < 1:
+            raise Exception("Checkpoint step must be positive")
+        workers = parallel.check_workers(workers)
+        n = upto // step
+        segment_size = max(SEGMENT_SIZE, math.isqrt(n * step + 1))
+        chunk = segment_size * PARALLEL_BLOCKS
+        tasks = [("count_sum", lo, min(lo + chunk, (k + 1) * step + 1), segment_size)
+                 for k in range(n) for lo in range(k * step + 1, (k + 1) * step + 1, chunk)]
+        base = array("Q", base_primes(n * step + 1))
+        if workers > 1:
+            results = parallel.imap_ordered(sieve_task, tasks, workers, {"base_primes": base})
+        else:
+            results = (sieve_task(*task, base) for task in tasks)
+
+        counts, sums = [0], [0]
+        count = total = 0
+        for (_, _, hi, _), (c, t) in zip(tasks, results):
+            count += c
+            total += t
+            if (hi - 1) % step == 0:
+                counts.append(count)
+                sums.append(total)
+        self.init_tables(step, counts, sums, cache_size)
+
+    def init_tables(self, step : int, counts : list[int], sums : list[int], cache_size : int) -> None:
+        self.step = step
+        self.counts = counts
+        self.sums = sums
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    @property
+    def upto(self) -> int:
+        """The last checkpoint"""
+        return (len(self.counts) - 1) * self.step
+
+    def pi(self, x : int) -> int:
+        """Number of primes <= x"""
+        return self.lookup("pi", x)
+
+    def prime_sum(self, x : int) -> int:
+        """Sum of primes <= x"""
+        return self.lookup("sum", x)
+
+    def lookup(self, kind : str, x : int) -> int:
+        if x < 2:
+            return 0
+        key = (kind, x)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        k = min((x + self.step // 2) // self.step, len(self.counts) - 1) # nearest checkpoint, or the last one up to a step behind x
+        checkpoint = k * self.step
+        if x - checkpoint > self.step:
+            self.remember(key, prime_pi(x) if kind == "pi" else prime_sum(x))
+            return self.cache[key]
+
+        count, total = self.counts[k], self.sums[k]
+        if x >= checkpoint:
+            gap_count, gap_sum = count_and_sum_primes_in_range(checkpoint + 1, x + 1)
+            count, total = count + gap_count, total + gap_sum
+        else:
+            gap_count, gap_sum = count_and_sum_primes_in_range(x + 1, checkpoint + 1)
+            count, total = count - gap_count, total - gap_sum
+        self.remember(("pi", x), count)
+        self.remember(("sum", x), total)
+        return count if kind == "pi" else total
+
+    def remember(self, key : tuple[str, int], value : int) -> None:
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def save(self, path : str) -> None:
+        """Writes the checkpoints to path in the format described by CHECKPOINT_FILE_HEADER"""
+        counts = array("Q", self.counts)
+        if sys.byteorder == "big":
+            counts.byteswap()
+        with open(path, "wb") as f:
+            f.write(CHECKPOINT_FILE_HEADER.pack(CHECKPOINT_FILE_MAGIC, CHECKPOINT_FILE_VERSION, self.step, len(self.counts)))
+            f.write(counts.tobytes())
+            f.write(b"".join(s.to_bytes(CHECKPOINT_SUM_BYTES, "little") for s in self.sums))
+
+    @classmethod
+    def load(cls, path : str, *, cache_size : int = CHECKPOINT_CACHE_SIZE) -> "PrimeCheckpoints":
+        """Loads checkpoints written by save"""
+        with open(path, "rb") as f:
+            header = f.read(CHECKPOINT_FILE_HEADER.size)
+            if len(header) < CHECKPOINT_FILE_HEADER.size:
+                raise Exception("Not a checkpoint file: {}".format(path))
+            magic, version, step, n = CHECKPOINT_FILE_HEADER.unpack(header)
+            if magic != CHECKPOINT_FILE_MAGIC:
+                raise Exception("Not a checkpoint file: {}".format(path))
+            if version != CHECKPOINT_FILE_VERSION:
+                raise Exception("Unsupported checkpoint file version {}, expected {}".format(version, CHECKPOINT_FILE_VERSION))
+            counts = array("Q", f.read(8 * n))
+            sums = f.read(CHECKPOINT_SUM_BYTES * n)
+        if len(counts) != n or len(sums) != CHECKPOINT_SUM_BYTES * n:
+            raise Exception("Checkpoint file is truncated: {}".format(path))
+        if sys.byteorder == "big":
+            counts.byteswap()
+
+        checkpoints = cls.__new__(cls)
+        checkpoints.init_tables(step, counts.tolist(),
+                                [int.from_bytes(sums[i:i + CHECKPOINT_SUM_BYTES], "little") for i in range(0, len(sums), CHECKPOINT_SUM_BYTES)],
+                                cache_size)
+        return checkpoints
@@ -1,38 +1,45 @@
 from typing import Iterator
 from .primeSieve import PrimeSieve
-from .primes_utils import check_prime
+from .primality import is_probable_prime, TRIAL_PRIMES
+from .primeSieve import small_primes
+from .segmented_sieve import base_primes, SEGMENT_SIZE
 import math
+from array import array
+import random
+from collections import Counter
 from collections.abc import Iterable
-import itertools as it
+
+from . import instrumentation
+
+# iterations of Pollard-Rho tried before switching to ECM,
+# rho finds factors up to about 2*sqrt(budget) bits within it
+RHO_BUDGET = 1 << 16
+
+# stage 1 bounds of the successive ECM curve batches, and the number of curves per bound
+ECM_B1_BOUNDS = (2000, 11000, 50000, 250000, 1000000)
+ECM_CURVES = 25
 
 
 def get_prime_factors(num : int, prime_sieve : PrimeSieve = None) -> list[tuple[int, int]]:
+    """
+    Returns the prime factorization of num as a list of (prime, power) pairs in increasing order of primes.
+    The cheapest tier able to split each cofactor is picked automatically, see factorize.
+    """
     if prime_sieve is not None:
         return list(prime_factors_generator(num, prime_sieve))
     else:    
-        return get_prime_factorization_no_sieve(num)
+        return factorize(num)
 
 
 def prime_factors_generator(num : int, prime_sieve : PrimeSieve) -> Iterator[tuple[int, int]]:
     x = num
 
-    # if x is > prime_sieve.size this loop will try to bring it below the size
-    # by finding small primes and dividing by them
-    for d in it.chain([2], it.count(3, step=2)):
-        if x <= prime_sieve.size:
-            break
+    # beyond the sieve the factors are found by the tiered engine instead of the sieve walk
+    if x > prime_sieve.size:
+        yield from factorize(x, prime_sieve)
+        return
 
-        if not check_prime(d, prime_sieve) or x % d != 0:
-            continue
-        
-        factor_power = 0
-        while x % d == 0:
-            x = x//d
-            factor_power += 1
-        yield (d, factor_power)
-
-
-    spf = prime_sieve.smallest_prime_factor(x) # will be larger than any of the factors yielded before
+    spf = prime_sieve.smallest_prime_factor(x)
     while x > 1:
         factor_prime = spf
         factor_power = 0
@@ -44,6 +51,217 @@ def prime_factors_generator(num : int, prime_sieve : PrimeSieve) -> Iterator[tup
         
         yield (factor_prime, factor_power)
 
+
+def factorize(num : int, prime_sieve : PrimeSieve = None) -> list[tuple[int, int]]:
+    """
+    Tiered factorization engine:
+        1. trial division by the primes below 1000,
+        2. smallest prime factor walk in the sieve for cofactors <= prime_sieve.size,
+        3. a primality test for every remaining cofactor before any more work is spent on it,
+        4. Pollard-Rho (Brent) with a bounded budget, then ECM stage 1, then unbounded Pollard-Rho.
+    """
+    if num < 2:
+        return []
+    stats = instrumentation.STATS
+    factors = Counter()
+    x = num
+    for p in TRIAL_PRIMES:
+        if p * p > x:
+            break
+        while x % p == 0:
+            x //= p
+            factors[p] += 1
+    if stats is not None:
+        stats.count("factorize.trial_division", sum(factors.values()))
+
+    pending = [x] if x > 1 else []
+    while pending:
+        c = pending.pop()
+        if prime_sieve is not None and c <= prime_sieve.size:
+            if stats is not None:
+                stats.count("factorize.sieve")
+            for p, k in prime_factors_generator(c, prime_sieve):
+                factors[p] += k
+            continue
+        if is_probable_prime(c):
+            if stats is not None:
+                stats.count("factorize.prime")
+            factors[c] += 1
+            continue
+        d = find_factor(c)
+        pending.extend((d, c // d))
+
+    return sorted(factors.items())
+
+
+def find_factor(n : int) -> int:
+    """Returns a nontrivial factor of a composite n which has no prime factors below 1000"""
+    stats = instrumentation.STATS
+    r = math.isqrt(n)
+    if r * r == n:
+        if stats is not None:
+            stats.count("factorize.square")
+        return r
+    with instrumentation.timed("factorize.rho"):
+        d = pollard_rho_brent(n, budget=RHO_BUDGET)
+    if d is not None:
+        return d
+    for B1 in ECM_B1_BOUNDS:
+        with instrumentation.timed("factorize.ecm"):
+            d = ecm_stage1(n, B1, curves=ECM_CURVES)
+        if d is not None:
+            return d
+    with instrumentation.timed("factorize.rho_unbounded"):
+        return pollard_rho_brent(n)
+
+
+def pollard_rho_brent(n : int, budget : int = None, batch : int = 128, seed : int = 1) -> int:
+    """
+    Brent's variant of Pollard-Rho. The differences are multiplied together and a gcd is taken once per batch.
+    Returns a nontrivial factor of the composite n, or None if the budget of iterations was exhausted.
+    """
+    rng = random.Random(seed)
+    while True:
+        y, c = rng.randrange(1, n), rng.randrange(1, n)
+        g, r, q = 1, 1, 1
+        steps = 0
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(batch, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += batch
+            r *= 2
+            steps += r
+            if budget is not None and steps > budget and g == 1:
+                return None
+
+        if g == n:
+            # the batch overshot, redo it one step at a time
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+        if g != n:
+            return g
+        # the cycle closed for both factors at once, retry with other constants
+
+
+def ecm_stage1(n : int, B1 : int, curves : int, seed : int = 1) -> int:
+    """
+    Stage 1 of Lenstra's elliptic curve method on Montgomery curves with Suyama's parametrization.
+    Returns a nontrivial factor of n, or None if none of the curves found one.
+    """
+    rng = random.Random(seed)
+    multipliers = [p ** int(math.log(B1, p)) for p in small_primes(B1)]
+
+    for _ in range(curves):
+        sigma = rng.randrange(6, n - 1)
+        u = (sigma * sigma - 5) % n
+        v = 4 * sigma % n
+        X, Z = pow(u, 3, n), pow(v, 3, n)
+        denominator = 16 * pow(u, 3, n) * v % n
+        g = math.gcd(denominator, n)
+        if g != 1:
+            if g != n:
+                return g
+            continue
+        a24 = pow(v - u, 3, n) * (3 * u + v) * pow(denominator, -1, n) % n
+
+        for m in multipliers:
+            X, Z = montgomery_ladder(m, X, Z, a24, n)
+        g = math.gcd(Z, n)
+        if 1 < g < n:
+            return g
+    return None
+
+
+def montgomery_ladder(k : int, X : int, Z : int, a24 : int, n : int) -> tuple[int, int]:
+    """Computes k*P of the point P = (X : Z) on a Montgomery curve, in projective x-only coordinates"""
+    def double(X, Z):
+        s, d = (X + Z) ** 2 % n, (X - Z) ** 2 % n
+        t = s - d
+        return s * d % n, t * (d + a24 * t) % n
+
+    def add(X1, Z1, X2, Z2):
+        u = (X1 - Z1) * (X2 + Z2)
+        v = (X1 + Z1) * (X2 - Z2)
+        return Z * (u + v) ** 2 % n, X * (u - v) ** 2 % n
+
+    R0, R1 = (X, Z), double(X, Z)
+    for bit in bin(k)[3:]:
+        if bit == "1":
+            R0, R1 = add(*R1, *R0), double(*R1)
+        else:
+            R1, R0 = add(*R0, *R1), double(*R0)
+    return R0
+
+
+def factorize_range(lo : int, hi : int, prime_sieve : PrimeSieve = None) -> tuple[array, array, array]:
+    """
+    Factorizes every n with lo <= n < hi (lo >= 1) at once.
+
+    The smallest prime factor table of prime_sieve is walked directly if hi - 1 <= prime_sieve.size,
+    otherwise every block of the range is factored by dividing out each base prime from its multiples.
+    As in factorize, a growable sieve is never extended for the range.
+
+    Returns:
+        a CSR style triple (offsets, primes, exponents) of arrays, such that the factorization of lo+i is
+        zip(primes[offsets[i]:offsets[i+1]], exponents[offsets[i]:offsets[i+1]]), primes in increasing order
+    """
+    if lo < 1:
+        raise Exception("Only positive integers can be factorized")
+    offsets, primes, exponents = array("Q", [0]), array("Q"), array("B")
+    if hi <= lo:
+        return offsets, primes, exponents
+
+    if prime_sieve is not None and prime_sieve.layout != "bitmap" and hi - 1 <= prime_sieve.size:
+        table = prime_sieve.sieve
+        for n in range(lo, hi):
+            x = n
+            while x > 1:
+                p = table[x] or x
+                e = 0
+                while x % p == 0:
+                    x //= p
+                    e += 1
+                primes.append(p)
+                exponents.append(e)
+            offsets.append(len(primes))
+        return offsets, primes, exponents
+
+    base = base_primes(hi, prime_sieve)
+    for seg_lo in range(lo, hi, SEGMENT_SIZE):
+        seg_hi = min(seg_lo + SEGMENT_SIZE, hi)
+        residual = list(range(seg_lo, seg_hi))
+        factors = [[] for _ in residual]
+        for p in base:
+            if p * p >= seg_hi:
+                break
+            for i in range(-seg_lo % p, seg_hi - seg_lo, p):
+                r, e = residual[i], 0
+                while r % p == 0:
+                    r //= p
+                    e += 1
+                residual[i] = r
+                factors[i].append((p, e))
+
+        for r, f in zip(residual, factors):
+            if r > 1:
+                f.append((r, 1)) # what is left is a prime larger than every factor divided out
+            for p, e in f:
+                primes.append(p)
+                exponents.append(e)
+            offsets.append(len(primes))
+    return offsets, primes, exponents
+
+
 # O(sqrt(n))
 def get_prime_factorization_no_sieve(num : int) -> list[tuple[int, int]]:
     if (num < 2):
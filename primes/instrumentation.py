@@ -0,0 +1,77 @@
+from typing import Iterator
+from collections import Counter
+import contextlib
+import time
+
+# the Stats collecting the events of the package, None when instrumentation is disabled.
+# Instrumented code reads it once and does nothing else if it is None, so a disabled run
+# only pays one global lookup per instrumented call
+STATS = None
+
+
+class Stats:
+    """
+    Counters and timers of the instrumented code paths of the package, filled while installed by collect_stats.
+    Counter names are dotted paths, e.g.
+        sieve.spf.table / sieve.spf.trial_division - smallest_prime_factor answered by the table or by trial division
+        check_prime.table / check_prime.probable_prime - primality read from the sieve or tested
+        factorize.<tier> - cofactors handled by each tier of factorization.factorize
+        phi.<path> - calls of LegendrePhi answered by its tables, the pi shortcut, the cache or the recurrence
+        pi_generic.list / pi_generic.lucy_fallback - where pi_generic took its value from
+    Timers accumulate the seconds and the number of calls of sieve builds and of prime counting and summing.
+    Work done in worker processes is not counted.
+    """
+    def __init__(self):
+        self.counters = Counter()
+        self.seconds = Counter()
+        self.calls = Counter()
+
+    def count(self, name : str, k : int = 1) -> None:
+        self.counters[name] += k
+
+    @contextlib.contextmanager
+    def timer(self, name : str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.seconds.clear()
+        self.calls.clear()
+
+    def as_dict(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "timers": {name: {"seconds": self.seconds[name], "calls": self.calls[name]} for name in self.seconds},
+        }
+
+    def report(self) -> str:
+        """Human readable table of the counters and timers"""
+        lines = ["{:<40} {:>12}".format(name, value) for name, value in sorted(self.counters.items())]
+        lines += ["{:<40} {:>11.4f}s {:>8} calls".format(name, self.seconds[name], self.calls[name]) for name in sorted(self.seconds)]
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def collect_stats(stats : Stats = None) -> Iterator[Stats]:
+    """
+    Enables the instrumentation inside the with block, and yields the Stats filled by it.
+    A given stats keeps accumulating across blocks. The previously installed Stats is restored on exit.
+    """
+    global STATS
+    if stats is None:
+        stats = Stats()
+    previous, STATS = STATS, stats
+    try:
+        yield stats
+    finally:
+        STATS = previous
+
+
+def timed(name : str):
+    """Context manager timing its block into the installed Stats, or doing nothing when instrumentation is disabled"""
+    return STATS.timer(name) if STATS is not None else contextlib.nullcontext()
@@ -0,0 +1,270 @@
+from fractions import Fraction
+from multiprocessing import shared_memory
+import multiprocessing
+import functools as ft
+import math
+
+from .primeSieve import np, small_primes
+from . import parallel
+from . import instrumentation
+
+# engines of the Lucy_Hedgehog sieve, "auto" picks numpy when it is installed and the values fit in int64
+ENGINES = ("auto", "python", "numpy")
+
+# bound on every value stored by the numpy engine, leaving a bit of headroom below 2^63
+INT64_BOUND = 1 << 62
+
+# largest primes below 2^31, exact sums too large for int64 are sieved modulo several of them
+# and recombined with the chinese remainder theorem
+CRT_MODULI = (2147483647, 2147483629, 2147483587, 2147483579, 2147483563, 2147483549)
+
+# with workers, the primes whose update touches at least this many large values are sieved by all workers together,
+# each one updating a slice of the tables, the remaining primes are cheaper to sieve in the calling process
+LUCY_PARALLEL_MIN = 1 << 15
+
+
+@ft.lru_cache(maxsize=None)
+def faulhaber(k : int) -> tuple[tuple[int, ...], int]:
+    """
+    Returns (coefficients, denominator) such that sum(n^k for 1 <= n <= v) equals
+    sum(c * v^j for j, c in enumerate(coefficients)) // denominator, by Faulhaber's formula
+    """
+    bernoulli = [Fraction(1)]
+    for m in range(1, k + 1):
+        bernoulli.append(-sum(math.comb(m + 1, j) * bernoulli[j] for j in range(m)) / (m + 1))
+    if k >= 1:
+        bernoulli[1] = -bernoulli[1] # B_1 = +1/2 convention
+
+    coefficients = [Fraction(0)] * (k + 2)
+    for j in range(k + 1):
+        coefficients[k + 1 - j] = Fraction(math.comb(k + 1, j)) * bernoulli[j] / (k + 1)
+    denominator = math.lcm(*(c.denominator for c in coefficients))
+    return tuple(int(c * denominator) for c in coefficients), denominator
+
+
+def power_sum(v : int, k : int) -> int:
+    """Returns sum(n^k for 1 <= n <= v)"""
+    coefficients, denominator = faulhaber(k)
+    total = 0
+    for c in reversed(coefficients):
+        total = total * v + c
+    return total // denominator
+
+
+def crt(residues : list, moduli : list[int]):
+    """
+    Combines numpy arrays of residues modulo the pairwise coprime moduli into the values in [0, prod(moduli)),
+    returned as a numpy object array of python ints. Garner's mixed radix digits all stay below 2^31.
+    """
+    digits = []
+    for m, a in zip(moduli, residues):
+        acc = np.zeros_like(a)
+        radix = 1
+        for d, m_prev in zip(digits, moduli):
+            acc = (acc + d * (radix % m)) % m
+            radix *= m_prev
+        digits.append((a - acc) % m * pow(radix % m, -1, m) % m)
+
+    values = np.zeros(len(residues[0]), dtype=object)
+    radix = 1
+    for d, m in zip(digits, moduli):
+        values += d.astype(object) * radix
+        radix *= m
+    return values
+
+
+class LucyTable:
+    """
+    Values S(v) = sum(p^k for primes p <= v) (modulo mod, if given) at every v = N // i, as computed by the
+    Lucy_Hedgehog sieve. They are kept in two flat tables instead of a dict keyed by v:
+        small[v]  = S(v)      for 0 <= v <= r,
+        large[i]  = S(N // i) for 1 <= i <= r,
+    where r = isqrt(N). Both are lists, or int64 numpy arrays when built by the numpy engine.
+
+    Instead of p^k any completely multiplicative f can be summed, by passing f and prefix,
+    where prefix(v) = sum(f(n) for 1 <= n <= v). Without a mod such sums always use the python engine.
+
+    Exact sums of p^k which do not fit in int64 are computed by the numpy engine modulo several primes
+    of CRT_MODULI and recombined, as long as their product bounds the values.
+
+    With workers, the numpy engine splits the updates of the small primes over that many processes
+    sharing the tables, see sieve_numpy_parallel. The result is identical to the serial one.
+    """
+    def __init__(self, N : int, k : int = 0, mod : int = None, engine : str = "auto", f = None, prefix = None, *, workers : int = None):
+        if engine not in ENGINES:
+            raise Exception("Unknown Lucy_Hedgehog engine '{}', expected one of {}".format(engine, ENGINES))
+        if (f is None) != (prefix is None):
+            raise Exception("f and prefix must be supplied together")
+        moduli = [mod]
+        if f is None:
+            f = lambda p: p**k
+            prefix = lambda v: power_sum(v, k)
+            bound = power_sum(N, k)
+            if mod is None and bound >= INT64_BOUND:
+                count = next((t for t in range(1, len(CRT_MODULI) + 1) if math.prod(CRT_MODULI[:t]) > bound), None)
+                moduli = list(CRT_MODULI[:count]) if count is not None else [None]
+        else:
+            bound = INT64_BOUND # nothing is known about the growth of f
+        fits = mod is not None and mod * mod < INT64_BOUND or mod is None and (bound < INT64_BOUND or moduli != [None])
+        if engine == "numpy" and (np is None or not fits):
+            raise Exception("numpy engine needs numpy installed and all values bounded by 2^62")
+        if engine == "auto":
+            engine = "numpy" if np is not None and fits else "python"
+
+        self.N = N
+        self.k = k
+        self.mod = mod
+        self.f = f
+        self.prefix = prefix
+        self.engine = engine
+        self.workers = parallel.check_workers(workers)
+        self.r = math.isqrt(N)
+        with instrumentation.timed("lucy." + engine):
+            self.small, self.large = self.initial_tables()
+            if engine == "python":
+                self.sieve_python()
+            elif moduli == [mod]:
+                self.small, self.large = self.sieve_numpy(self.small, self.large, mod)
+            else:
+                residues = [self.sieve_numpy(self.small, self.large, m) for m in moduli]
+                self.small, self.large = (crt([r[j] for r in residues], moduli).tolist() for j in (0, 1))
+
+    def initial_tables(self) -> tuple[list[int], list[int]]:
+        """Tables of T(v) = sum(f(n) for 2 <= n <= v), the values before any prime is sieved out"""
+        def T(v):
+            t = self.prefix(v) - 1 if v >= 1 else 0
+            return t % self.mod if self.mod is not None else t
+
+        small = [T(v) for v in range(self.r + 1)]
+        large = [0] + [T(self.N // i) for i in range(1, self.r + 1)]
+        return small, large
+
+    def sieve_python(self) -> None:
+        N, r, mod = self.N, self.r, self.mod
+        small, large = self.small, self.large
+        for p in small_primes(r):
+            sp = small[p-1]
+            pk = self.f(p) if mod is None else self.f(p) % mod
+            p2 = p * p
+
+            # large values N // i >= p^2, their quotient by p is N // (i*p)
+            for i in range(1, min(r, N // p2) + 1):
+                d = i * p
+                removed = pk * ((large[d] if d <= r else small[N // d]) - sp)
+                large[i] = large[i] - removed if mod is None else (large[i] - removed) % mod
+
+            # small values p^2 <= v <= r, updated from the top so small[v // p] is still the previous value
+            for v in range(r, p2 - 1, -1):
+                removed = pk * (small[v // p] - sp)
+                small[v] = small[v] - removed if mod is None else (small[v] - removed) % mod
+
+    def sieve_numpy(self, small : list[int], large : list[int], mod : int):
+        """Sieves copies of the initial tables, reduced modulo mod if given, and returns them as numpy arrays"""
+        N, r = self.N, self.r
+        if mod is not None and self.mod is None:
+            small, large = [t % mod for t in small], [t % mod for t in large]
+        small = np.array(small, dtype=np.int64)
+        large = np.array(large, dtype=np.int64)
+        quotients_of_N = np.concatenate(([0], N // np.arange(1, r + 1, dtype=np.int64))) # N // i at index i
+        primes = small_primes(r)
+        start = 0
+        if self.workers > 1:
+            start = sum(1 for p in primes if min(r, N // (p * p)) >= LUCY_PARALLEL_MIN)
+            if start:
+                small, large = self.sieve_numpy_parallel(small, large, mod, primes[:start])
+
+        for p in primes[start:]:
+            pk = self.f(p) if mod is None else self.f(p) % mod
+            L = min(r, N // (p * p))
+            large_delta, small_delta = lucy_deltas(small, large, quotients_of_N, N, p, pk, 1, L + 1, p * p, r + 1)
+            large[1:L+1] -= large_delta
+            small[p*p:] -= small_delta
+            if mod is not None:
+                large[1:L+1] %= mod
+                small[p*p:] %= mod
+        return small, large
+
+    def sieve_numpy_parallel(self, small, large, mod : int, primes : list[int]):
+        """
+        Sieves the numpy tables by the given primes on self.workers processes. The tables are copied to shared memory,
+        and for every prime each worker computes the updates of its slices of both tables from the previous values,
+        waits for the others, applies them and waits again, so the tables always go through the serial states.
+        """
+        shms = [shared_memory.SharedMemory(create=True, size=table.nbytes) for table in (small, large)]
+        try:
+            for shm, table in zip(shms, (small, large)):
+                np.ndarray(table.shape, dtype=np.int64, buffer=shm.buf)[:] = table
+            state = {
+                "lucy": (self.N, self.r, mod, [shm.name for shm in shms]),
+                "lucy_primes": [(p, self.f(p) if mod is None else self.f(p) % mod) for p in primes],
+                "barrier": multiprocessing.get_context().Barrier(self.workers),
+            }
+            parallel.map_ordered(lucy_sieve_task, [(w, self.workers) for w in range(self.workers)], self.workers, state)
+            return tuple(np.ndarray(table.shape, dtype=np.int64, buffer=shm.buf).copy() for shm, table in zip(shms, (small, large)))
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    def __getitem__(self, v : int) -> int:
+        """S(v) for v <= isqrt(N) or v = N // i"""
+        return int(self.small[v]) if v <= self.r else int(self.large[self.N // v])
+
+    def items(self):
+        """Yields the pairs (v, S(v)) for every distinct v = N // i, in decreasing order of v"""
+        for i in range(1, self.r + 1):
+            if self.N // i > self.r:
+                yield self.N // i, int(self.large[i])
+        for v in range(self.r, 0, -1):
+            yield v, int(self.small[v])
+
+
+def lucy_deltas(small, large, quotients_of_N, N : int, p : int, pk : int, i_lo : int, i_hi : int, v_lo : int, v_hi : int):
+    """
+    Returns the amounts subtracted from large[i_lo:i_hi] and small[v_lo:v_hi] when the prime p is sieved out,
+    computed from the tables before the update. i_hi - 1 must not exceed N // p^2 and v_lo must be at least p^2.
+    """
+    r = len(small) - 1
+    sp = int(small[p-1])
+    m = min(i_hi - 1, r // p) # large values up to index m are divided by p into large values, the next ones into small values
+    quotients = large[i_lo*p:m*p+1:p] if m >= i_lo else large[:0]
+    if i_hi - 1 > m:
+        quotients = np.concatenate((quotients, small[quotients_of_N[max(i_lo, m+1):i_hi] // p]))
+    return pk * (quotients - sp), pk * (small[np.arange(v_lo, v_hi) // p] - sp)
+
+
+def lucy_sieve_task(w : int, workers : int) -> None:
+    """Worker w of LucyTable.sieve_numpy_parallel, updating the w-th slices of the shared tables for every prime"""
+    N, r, mod, names = parallel.WORKER_STATE["lucy"]
+    barrier = parallel.WORKER_STATE["barrier"]
+    shms = [shared_memory.SharedMemory(name) for name in names]
+    small = large = None
+    try:
+        small, large = (np.ndarray((r + 1,), dtype=np.int64, buffer=shm.buf) for shm in shms)
+        quotients_of_N = np.concatenate(([0], N // np.arange(1, r + 1, dtype=np.int64)))
+        for p, pk in parallel.WORKER_STATE["lucy_primes"]:
+            L = min(r, N // (p * p))
+            i_lo, i_hi = 1 + L * w // workers, 1 + L * (w + 1) // workers
+            v_lo, v_hi = p * p + (r + 1 - p * p) * w // workers, p * p + (r + 1 - p * p) * (w + 1) // workers
+            large_delta, small_delta = lucy_deltas(small, large, quotients_of_N, N, p, pk, i_lo, i_hi, v_lo, v_hi)
+            barrier.wait()
+            large[i_lo:i_hi] -= large_delta
+            small[v_lo:v_hi] -= small_delta
+            if mod is not None:
+                large[i_lo:i_hi] %= mod
+                small[v_lo:v_hi] %= mod
+            barrier.wait()
+    except BaseException:
+        barrier.abort() # release the other workers instead of leaving them waiting forever
+        raise
+    finally:
+        del small, large # the views must be gone before the segments are closed
+        for shm in shms:
+            shm.close()
+
+
+def lucy_hedgehog(N : int, k : int = 0, mod : int = None, engine : str = "auto", *, workers : int = None) -> int:
+    """Returns the sum of p^k over the primes p <= N, modulo mod if given"""
+    if N < 2:
+        return 0
+    return LucyTable(N, k, mod, engine, workers=workers)[N]
@@ -0,0 +1,51 @@
+from typing import Callable, Iterable, Iterator
+import collections
+import concurrent.futures
+
+# state installed in every worker process by the pool initializer, shared by all the tasks the worker runs
+WORKER_STATE = {}
+
+
+def init_worker(state : dict) -> None:
+    WORKER_STATE.update(state)
+
+
+def check_workers(workers : int) -> int:
+    """Returns the number of processes to use, 1 meaning the calling process alone"""
+    if workers is None:
+        return 1
+    if not isinstance(workers, int) or workers < 1:
+        raise Exception("workers must be a positive number of processes, got {}".format(workers))
+    return workers
+
+
+def imap_ordered(func : Callable, tasks : Iterable[tuple], workers : int, state : dict = None, *, lookahead : int = None) -> Iterator:
+    """
+    Lazily yields func(*task) for every task, in the order of tasks, computed on a pool of workers processes.
+
+    Args:
+        func: module level function run in the workers.
+        tasks: argument tuples, consumed lazily.
+        state: dict copied once into WORKER_STATE of every worker, for data shared by all tasks.
+        lookahead: maximal number of tasks in flight, bounding the memory of results not consumed yet.
+            Defaults to twice the number of workers.
+    """
+    if lookahead is None:
+        lookahead = 2 * workers
+    pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(state or {},))
+    try:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.submit(func, *task))
+            if len(pending) >= lookahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def map_ordered(func : Callable, tasks : Iterable[tuple], workers : int, state : dict = None) -> list:
+    """Returns [func(*task) for task in tasks] computed on a pool of workers processes, see imap_ordered"""
+    tasks = list(tasks)
+    return list(imap_ordered(func, tasks, workers, state, lookahead=max(len(tasks), 1)))
@@ -2,12 +2,18 @@ from bisect import bisect
 from typing import Sequence
 import functools as ft
 import itertools as it
+from collections import OrderedDict
 import operator
 import typing
 import math
 
-from .primeSieve import PrimeSieve
+from .primeSieve import PrimeSieve, np
 from .primes_utils import prime_list, next_prime 
+from .segmented_sieve import count_primes_in_range, primes_in_range, prime_counts_at
+from .arithmetic_functions import arithmetic_tables
+from .lucy import lucy_hedgehog
+from . import parallel
+from . import instrumentation
 
 T = typing.TypeVar('T')
 
@@ -28,7 +34,81 @@ def S_brute_force(N : int, k : int, prime_list : list[int]) -> int:
     return total
 
 
-def legendre_sum(N : int, a : int, prime_list : list[int]) -> int:
+# number of leading primes whose primorial is the period of the precomputed phi tables (2*3*5*7*11*13 = 30030)
+PHI_TABLE_A = 6
+
+# maximal number of (x, a) pairs remembered by LegendrePhi
+PHI_CACHE_SIZE = 1 << 16
+
+
+class LegendrePhi:
+    """
+    Computes phi(x, a), the number of positive integers <= x not divisible by any of the first a primes.
+
+    Uses the recurrence phi(x, a) = phi(x, a-1) - phi(x // p_a, a-1), unrolled over a so that the
+    recursion depth only grows with the number of divisions of x, together with:
+        - tables of phi(r, a) for r below the primorial Q_a of the first a <= PHI_TABLE_A primes,
+          since phi(x, a) = (x // Q_a) * phi(Q_a, a) + phi(x % Q_a, a),
+        - phi(x, a) = 1 + max(pi(x) - a, 0) whenever x < p_(a+1)^2 and pi(x) can be read from the prime list,
+        - a bounded least recently used cache of the remaining values.
+    """
+    def __init__(self, prime_list : list[int], cache_size : int = PHI_CACHE_SIZE):
+        self.primes = prime_list
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        self.table_a = min(PHI_TABLE_A, len(prime_list))
+        self.periods = [1]
+        self.tables = [[0]]
+        for a in range(1, self.table_a + 1):
+            Q = self.periods[-1] * prime_list[a-1]
+            coprime = bytearray([1]) * Q
+            for p in prime_list[:a]:
+                coprime[0::p] = bytes(len(range(0, Q, p)))
+            self.periods.append(Q)
+            self.tables.append(list(it.accumulate(coprime)))
+
+    def __call__(self, x : int, a : int) -> int:
+        if a == 0:
+            return x
+        stats = instrumentation.STATS
+        if a <= self.table_a:
+            if stats is not None:
+                stats.count("phi.table")
+            Q, table = self.periods[a], self.tables[a]
+            return (x // Q) * table[-1] + table[x % Q]
+        if x <= self.primes[a-1]:
+            return 1 if x >= 1 else 0
+
+        bound = self.primes[a] if a < len(self.primes) else self.primes[a-1]
+        if x < bound * bound and x <= self.primes[-1]:
+            if stats is not None:
+                stats.count("phi.pi_shortcut")
+            return 1 + max(pi_from_list(x, self.primes) - a, 0)
+
+        key = (x, a)
+        if key in self.cache:
+            if stats is not None:
+                stats.count("phi.cache_hit")
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if stats is not None:
+            stats.count("phi.recurrence")
+
+        result = self(x, self.table_a)
+        for i in range(self.table_a + 1, a + 1):
+            p = self.primes[i-1]
+            if p > x:
+                break
+            result -= self(x // p, i - 1)
+
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+
+def legendre_sum(N : int, a : int, prime_list : list[int], _phi : LegendrePhi = None, *, workers : int = None) -> int:
     """
     Returns the total number of positive integers x <= N that are not divisible by any of the first a primes
 
@@ -36,11 +116,36 @@ def legendre_sum(N : int, a : int, prime_list : list[int]) -> int:
         N: the number positive integers to check up to.
         a: consider only the first a primes.
         prime_list: list of primes; must contain at least a elements
-    
+        _phi: a LegendrePhi over prime_list whose cache can be reused between calls
+        workers: number of processes sharing the leaves phi(N // p_i, i-1) of the unrolled recurrence,
+            each with its own LegendrePhi. Their sum is the same as the serial result.
+
     Returns:
         the total number of positive integers x such that x <= N and x is not divisible by any of the first a primes
     """
     assert(a <= len(prime_list))
+    if _phi is None:
+        _phi = LegendrePhi(prime_list)
+    workers = parallel.check_workers(workers)
+    if workers == 1 or a <= _phi.table_a:
+        return _phi(N, a)
+
+    # leaves are interleaved over the tasks, as their cost falls quickly with i
+    last = min(a, pi_from_list(N, prime_list))
+    tasks = [(N, range(i, last + 1, 4 * workers)) for i in range(_phi.table_a + 1, _phi.table_a + 1 + 4 * workers)]
+    leaves = parallel.map_ordered(phi_leaves_task, tasks, workers, {"phi_primes": prime_list})
+    return _phi(N, _phi.table_a) - sum(leaves)
+
+def phi_leaves_task(N : int, indices : range) -> int:
+    """Worker side of legendre_sum, the sum of phi(N // p_i, i-1) over the given indices i"""
+    if "phi" not in parallel.WORKER_STATE:
+        parallel.WORKER_STATE["phi"] = LegendrePhi(parallel.WORKER_STATE["phi_primes"])
+    phi, primes = parallel.WORKER_STATE["phi"], parallel.WORKER_STATE["phi_primes"]
+    return sum(phi(N // primes[i-1], i - 1) for i in indices)
+
+def legendre_sum_inclusion_exclusion(N : int, a : int, prime_list : list[int]) -> int:
+    """Reference implementation of legendre_sum, evaluating the inclusion-exclusion formula term by term"""
+    assert(a <= len(prime_list))
     total = 0
     sign = 1
     i = 0
@@ -71,16 +176,58 @@ def pi_legendre(N : int, _prime_sieve : PrimeSieve = None) -> int:
     a = pi_from_list(sqrtN, pl)
     return a + legendre_sum(N, a, pl) - 1
 
-def pi_brute(N : int):
-    ps = PrimeSieve(N)
-    return len(prime_list(ps, upto=N))
+def pi_brute(N : int, _prime_sieve : PrimeSieve = None, *, workers : int = None) -> int:
+    """Counts the primes <= N with the segmented sieve, split over workers processes if given"""
+    return count_primes_in_range(2, N+1, _prime_sieve, workers=workers)
 
 def pi_from_list(x : int, prime_list : list[int]) -> int:
     return bisect(prime_list, x)
 
-def P(k : int, N : int, a : int, _prime_sieve : PrimeSieve, _prime_list : list[int]) -> int:
+def icbrt(N : int) -> int:
+    """Integer cube root, the largest r such that r**3 <= N"""
+    r = round(N ** (1/3))
+    while r**3 > N:
+        r -= 1
+    while (r+1)**3 <= N:
+        r += 1
+    return r
+
+def P2(N : int, a : int, _prime_list : list[int], *, workers : int = None) -> int:
+    """
+    The number of positive integers <=N which are products of precisely 2 primes p_i <= p_j with i > a,
+    i.e. the sum of pi(N // p_i) - (i-1) over a < i <= pi(sqrt(N)).
+    All pi(N // p_i) are read from a single segmented sieve sweep over [sqrt(N), N // p_(a+1)],
+    split into consecutive parts swept by workers processes if given.
+    _prime_list must contain all primes <= sqrt(N).
+    """
+    sqrtN = math.isqrt(N)
+    b = pi_from_list(sqrtN, _prime_list) # p_b is the largest prime <= sqrt(N)
+    if a >= b:
+        return 0 #because p_b is the last prime <=sqrt(N), so a>=b implies p_{a+1} > sqrt(N) so p{a+1}*p{j>=(a+1)} > N
+
+    points = [N // _prime_list[i-1] for i in range(b, a, -1)] # increasing
+    pn = (b - a) * (b + a - 1) // 2
+    return sum(prime_counts_at(points, sqrtN + 1, b, workers=workers)) - pn
+
+def P3(N : int, a : int, _prime_list : list[int]) -> int:
+    """
+    The number of positive integers <=N which are products of precisely 3 primes p_i <= p_j <= p_k with i > a.
+    Every pi(N // (p_i * p_j)) is at most sqrt(N) when p_(a+1) > N^(1/4), so it is read from the prime list.
+    _prime_list must contain all primes <= sqrt(N).
+    """
+    c = pi_from_list(icbrt(N), _prime_list)
+    total = 0
+    for i in range(a+1, c+1):
+        Np = N // _prime_list[i-1]
+        b_i = pi_from_list(math.isqrt(Np), _prime_list)
+        for j in range(i, b_i+1):
+            total += pi_from_list(Np // _prime_list[j-1], _prime_list) - (j - 1)
+    return total
+
+def P(k : int, N : int, a : int, _prime_sieve : PrimeSieve, _prime_list : list[int], *, workers : int = None) -> int:
     """
     The number of positive integers <=N which can be written as products of precisely k primes p_i where i>a.
+    workers is passed to P2.
     """
     if k == 1:
         # in this case the only numbers that can be written as a product of one prime
@@ -90,24 +237,25 @@ def P(k : int, N : int, a : int, _prime_sieve : PrimeSieve, _prime_list : list[i
         return 0
 
     if k == 2:
-        b = pi_generic(math.isqrt(N), _prime_sieve, _prime_list) # p_b is the largest prime <= sqrt(N)
-        if a >= b:
-            return 0 #because p_b is the last prime <=sqrt(N), so a>=b implies p_{a+1} > sqrt(N) so p{a+1}*p{j>=(a+1)} > N 
-        
-        pn = (b - a) * (b + a - 1) // 2
-        s = sum(map(lambda i: pi_generic(N//_prime_list[i-1], _prime_sieve, _prime_list), range(a+1, b+1)))
-        return s - pn
-    
-    raise Exception("P_k is not implemented for k != 2")
+        return P2(N, a, _prime_list, workers=workers)
+
+    if k == 3:
+        return P3(N, a, _prime_list)
 
-def pi_meissel(N : int, _prime_sieve : PrimeSieve = None, _prime_list : list[int] = None) -> int:
+    raise Exception("P_k is not implemented for k > 3")
+
+def pi_meissel(N : int, _prime_sieve : PrimeSieve = None, _prime_list : list[int] = None, *, workers : int = None) -> int:
+    """
+    Computes the value of the pi function at N using Meissel's formula pi(N) = phi(N, c) + c - 1 - P2(N, c) with c = pi(N^(1/3)).
+    With workers, the leaves of phi and the sweep of P2 are split over that many processes.
+    """
     #print("call to pi_meissel with N={}".format(N))
     
-    if N == 1:
+    if N <= 1:
         return 0
     
     sqrtN = math.isqrt(N)
-    cbrtN = math.floor(N**(1/3))
+    cbrtN = icbrt(N)
     
     # create sieve and prime list if they are not supplied by a previous iteration
     if _prime_sieve is None:
@@ -117,34 +265,192 @@ def pi_meissel(N : int, _prime_sieve : PrimeSieve = None, _prime_list : list[int
 
     c = pi_generic(cbrtN, _prime_sieve, _prime_list) #p_c is the largest prime <= cbrtN
 
-    lgsum = legendre_sum(N, c, _prime_list)
+    lgsum = legendre_sum(N, c, _prime_list, workers=workers)
 
-    p2 = P(2, N, c, _prime_sieve, _prime_list)
+    p2 = P(2, N, c, _prime_sieve, _prime_list, workers=workers)
 
     return lgsum - p2 + c - 1
 
+def pi_lehmer(N : int, _prime_list : list[int] = None, *, workers : int = None) -> int:
+    """
+    Computes the value of the pi function at N using Lehmer's formula
+    pi(N) = phi(N, a) + a - 1 - P2(N, a) - P3(N, a) with a = pi(N^(1/4))
+    With workers, the leaves of phi and the sweep of P2 are split over that many processes.
+    """
+    if N <= 1:
+        return 0
+    sqrtN = math.isqrt(N)
+    if _prime_list is None:
+        _prime_list = primes_in_range(2, sqrtN + 1)
+
+    a = pi_from_list(math.isqrt(sqrtN), _prime_list)
+    return legendre_sum(N, a, _prime_list, workers=workers) + a - 1 - P2(N, a, _prime_list, workers=workers) - P3(N, a, _prime_list)
+
+# below this pi_lmo counts primes with the plain segmented sieve
+LMO_MIN = 10**5
+
+# numbers per block of the special leaf sieve, and the width of the blocks of its unsieved counters
+LMO_SEGMENT_SIZE = 1 << 20
+LMO_BLOCK = 64
+
+def pi_lmo(N : int, alpha : int = None) -> int:
+    """
+    Computes the value of the pi function at N with the Lagarias-Miller-Odlyzko method.
+
+    With y = alpha * N^(1/3) and a = pi(y), pi(N) = phi(N, a) + a - 1 - P2(N, a), and phi(N, a) is split
+    into the ordinary leaves sum(mu(m) * phi(N // m, c)) over squarefree m <= y with lpf(m) > p_c, read from
+    the phi tables, and the special leaves -sum(mu(m) * phi(N // (m*p_b), b-1)) over m <= y < m*p_b with
+    lpf(m) > p_b. The special leaves are all below N // y, and are counted while [1, N // y] is sieved
+    block by block with the primes p_1, p_2, ..., p_a in turn. Unsieved numbers are counted per block of
+    LMO_BLOCK in numpy arrays. Once a block is sieved with all a primes its unsieved numbers above y are
+    exactly the primes, which gives the pi(N // p) values of P2 in the same sweep.
+    Uses O(N^(1/3)) memory besides the blocks and the primes up to sqrt(N). Requires numpy and N < 2^62.
+    """
+    if np is None:
+        raise Exception("pi_lmo requires numpy")
+    if N < LMO_MIN:
+        return pi_brute(N)
+    if N >= 1 << 62:
+        raise Exception("pi_lmo only supports N < 2^62")
+
+    if alpha is None:
+        alpha = max(1, round(math.log10(N) / 4.5))
+    sqrtN = math.isqrt(N)
+    y = min(alpha * icbrt(N), sqrtN)
+    pl = primes_in_range(2, sqrtN + 1)
+    a = pi_from_list(y, pl)
+    b = pi_from_list(sqrtN, pl)
+    c = min(a, PHI_TABLE_A)
+    phi_c = LegendrePhi(pl[:a])
+
+    # moebius function and least prime factors of m <= y, for the squarefree m only
+    mu = arithmetic_tables(y)["mu"]
+    lpf_table = PrimeSieve(y, layout="list").sieve
+    M = np.array([m for m in range(1, y+1) if mu[m] != 0], dtype=np.int64)
+    MU = np.array([mu[m] for m in M], dtype=np.int64)
+    LPF = np.array([lpf_table[m] or m for m in M], dtype=np.int64)
+    LPF[0] = y + 1 # m = 1 has no prime factors
+
+    p_c = pl[c-1] if c > 0 else 1
+    S1 = sum(int(MU[i]) * phi_c(N // int(M[i]), c) for i in range(len(M)) if LPF[i] > p_c)
+
+    S2 = 0
+    phi_before = [0] * (a + 1) # phi_before[b] = phi(low - 1, b - 1) for the current block [low, high)
+    pi_before = a - 1          # number of primes <= low - 1, with 1 still counted as unsieved
+    P2_points = [N // pl[i-1] for i in range(b, a, -1)] # increasing
+    P2_i = 0
+    P2_sum = 0
+
+    limit = N // y
+    W = LMO_BLOCK
+    lane = np.arange(W)
+    for low in range(1, limit + 1, LMO_SEGMENT_SIZE):
+        high = min(low + LMO_SEGMENT_SIZE, limit + 1)
+        length = -(-(high - low) // W) * W
+        seg = np.zeros(length, dtype=np.uint8)
+        seg[:high - low] = 1
+        blocks = seg.reshape(-1, W)
+        block_counts = blocks.sum(axis=1, dtype=np.int64)
+        seg_count = high - low
+
+        def count_upto(pos):
+            """Number of unsieved values among seg[0..pos] for every position in pos"""
+            bi = pos // W
+            prefix = np.cumsum(block_counts) - block_counts
+            within = (blocks[bi] * (lane <= (pos % W)[:, None])).sum(axis=1, dtype=np.int64)
+            return prefix[bi] + within
+
+        for bidx in range(1, a + 1):
+            p = pl[bidx-1]
+            if bidx > c:
+                # special leaves with low <= N // (m*p) < high, m > y // p, lpf(m) > p
+                m_lo = max((N // high) // p, y // p)
+                m_hi = min((N // low) // p, y)
+                if m_hi > m_lo:
+                    i0, i1 = np.searchsorted(M, [m_lo, m_hi], side="right")
+                    sel = LPF[i0:i1] > p
+                    m, mu_m = M[i0:i1][sel], MU[i0:i1][sel]
+                    if len(m):
+                        phi_values = phi_before[bidx] + count_upto(N // (m * p) - low)
+                        S2 -= int(np.dot(mu_m, phi_values))
+            phi_before[bidx] += seg_count
+
+            # remove the multiples of p, including p itself
+            start = -(-low // p) * p
+            idx = np.arange(start - low, high - low, p)
+            removed = idx[seg[idx] == 1]
+            if len(removed):
+                seg[removed] = 0
+                seg_count -= len(removed)
+                if len(removed) > len(block_counts):
+                    block_counts -= np.bincount(removed // W, minlength=len(block_counts))
+                else:
+                    np.subtract.at(block_counts, removed // W, 1)
+
+        # the block is now sieved by all primes <= y, so the unsieved values other than 1 are the primes > y
+        j = P2_i
+        while j < len(P2_points) and P2_points[j] < high:
+            j += 1
+        if j > P2_i:
+            pos = np.array(P2_points[P2_i:j], dtype=np.int64) - low
+            P2_sum += int((pi_before + count_upto(pos)).sum())
+            P2_i = j
+        pi_before += seg_count
+
+    p2 = P2_sum - (b - a) * (b + a - 1) // 2
+    return S1 + S2 + a - 1 - p2
+
+# prime counting backends selectable in prime_pi
+PI_METHODS = ("auto", "brute", "legendre", "meissel", "lehmer", "lmo", "lucy")
+
+# backends of prime_pi which can split their work over worker processes
+PI_PARALLEL_METHODS = ("brute", "meissel", "lehmer", "lucy")
+
+def prime_pi(N : int, method : str = "auto", *, workers : int = None) -> int:
+    """
+    Computes the value of the pi function at N with the selected backend.
+    "auto" counts small N with the segmented sieve, and uses pi_lmo above that, or pi_meissel without numpy.
+    With workers, "auto" uses pi_lucy_hedgehog above the segmented sieve range, and only the
+    PI_PARALLEL_METHODS backends are accepted.
+    """
+    if method not in PI_METHODS:
+        raise Exception("Unknown prime counting method '{}', expected one of {}".format(method, PI_METHODS))
+    serial = parallel.check_workers(workers) == 1
+    if method == "auto":
+        method = "brute" if N < LMO_MIN else ("lmo" if np is not None and serial else ("lucy" if np is not None else "meissel"))
+    if not serial and method not in PI_PARALLEL_METHODS:
+        raise Exception("Prime counting method '{}' does not support workers, expected one of {}".format(method, PI_PARALLEL_METHODS))
+
+    with instrumentation.timed("prime_pi." + method):
+        if method == "brute":
+            return pi_brute(N, workers=workers)
+        if method == "legendre":
+            return pi_legendre(N)
+        if method == "meissel":
+            return pi_meissel(N, workers=workers)
+        if method == "lehmer":
+            return pi_lehmer(N, workers=workers)
+        if method == "lmo":
+            return pi_lmo(N)
+        return pi_lucy_hedgehog(N, workers=workers)
+
 def pi_generic(N : int, _prime_sieve : PrimeSieve = None, _prime_list : list[int] = None) -> int:
+    stats = instrumentation.STATS
     if _prime_list is not None and N <= _prime_list[-1]:
+        if stats is not None:
+            stats.count("pi_generic.list")
         return pi_from_list(N, _prime_list)
     else:
+        if stats is not None:
+            stats.count("pi_generic.lucy_fallback")
         return pi_lucy_hedgehog(N)
 
-def pi_lucy_hedgehog(N: int) -> int:
-    r = math.isqrt(N)
-    div_results = [N // v for v in range(1, r+1)]
-    V = div_results + list(range(div_results[-1]-1, 0, -1))
-    
-    T = lambda x: x - 1
-    S = {v: T(v) for v in V}
-
-    for p in range(2,r+1):
-        if S[p] > S[p-1]:  # number of primes changed, so p must be a prime
-            for v in it.takewhile(lambda v: v >= p*p, V):
-                # nprap - number of new primes removed while sieving range [2..v] with p
-                # == number of primes in range [p..v//p]
-                nprap = S[v//p] - S[p-1]
-                S[v] -= nprap
-    return S[N]
+def pi_lucy_hedgehog(N: int, *, workers : int = None) -> int:
+    """
+    Computes the value of the pi function at N with the array based Lucy_Hedgehog sieve, see lucy.LucyTable.
+    With workers, the updates of the large values by the small primes are split over that many processes.
+    """
+    return lucy_hedgehog(N, k=0, workers=workers)
 
 if __name__ == "__main__":
 
@@ -0,0 +1,280 @@
+import math
+
+from .primeSieve import small_primes, np
+
+# primes used for trial division before any probable prime test is run,
+# all of them are tested at once with a single gcd against their product
+TRIAL_PRIMES = small_primes(1000)
+TRIAL_PRIMES_SET = frozenset(TRIAL_PRIMES)
+TRIAL_PRODUCT = math.prod(TRIAL_PRIMES)
+
+# bases making the Miller-Rabin test deterministic for every n < 2^64 (Jim Sinclair's set)
+MR_BASES_64 = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+
+
+def is_strong_probable_prime(n : int, a : int) -> bool:
+    """Miller-Rabin round: returns True iff odd n > 2 is a strong probable prime to base a"""
+    a %= n
+    if a == 0:
+        return True # the base carries no information about n
+
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+
+def jacobi(a : int, n : int) -> int:
+    """Jacobi symbol (a/n) for odd n > 0"""
+    a %= n
+    result = 1
+    while a != 0:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+
+def is_strong_lucas_probable_prime(n : int) -> bool:
+    """
+    Strong Lucas test with Selfridge's parameters P = 1, Q = (1-D)/4, where D is the first of
+    5, -7, 9, -11, ... with Jacobi symbol (D/n) = -1. n must be odd and not a perfect square.
+    """
+    D = 5
+    while True:
+        j = jacobi(D, n)
+        if j == -1:
+            break
+        if j == 0 and abs(D) != n:
+            return False
+        D = -D - 2 if D > 0 else -D + 2
+    P, Q = 1, (1 - D) // 4
+
+    d = n + 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    # binary ladder computing U_d, V_d and Q^d modulo n
+    U, V, Qk = 1, P, Q % n
+    for bit in bin(d)[3:]:
+        U = U * V % n
+        V = (V * V - 2 * Qk) % n
+        Qk = Qk * Qk % n
+        if bit == "1":
+            U, V = P * U + V, D * U + P * V
+            U = (U + n if U & 1 else U) // 2 % n
+            V = (V + n if V & 1 else V) // 2 % n
+            Qk = Qk * Q % n
+
+    if U == 0 or V == 0:
+        return True
+    for _ in range(s - 1):
+        V = (V * V - 2 * Qk) % n
+        Qk = Qk * Qk % n
+        if V == 0:
+            return True
+    return False
+
+
+def is_probable_prime(n : int) -> bool:
+    """
+    Sieve independent primality test.
+    Trial division by small primes, then a Miller-Rabin test with bases that are deterministic for n < 2^64,
+    and the Baillie-PSW test (base 2 strong probable prime + strong Lucas) above that.
+    BPSW has no known counterexample, so in practice the result is exact.
+    """
+    if n <= TRIAL_PRIMES[-1]:
+        return n in TRIAL_PRIMES_SET
+    if math.gcd(n, TRIAL_PRODUCT) != 1:
+        return False
+    if n < TRIAL_PRIMES[-1] ** 2:
+        return True # no prime <= sqrt(n) divides n
+
+    if n < 1 << 64:
+        return all(is_strong_probable_prime(n, a) for a in MR_BASES_64)
+
+    if math.isqrt(n) ** 2 == n:
+        return False
+    return is_strong_probable_prime(n, 2) and is_strong_lucas_probable_prime(n)
+
+
+# bases making the Miller-Rabin test deterministic for every n < 4759123141,
+# small enough for all products of residues to fit in uint64
+MR_BASES_32 = (2, 7, 61)
+
+
+def is_strong_probable_prime_many(n, a : int):
+    """
+    Vectorized Miller-Rabin round over a numpy uint64 array of odd n with a < n < 2^32.
+    Returns a boolean mask of the elements that are strong probable primes to base a.
+    """
+    one = np.uint64(1)
+    n_minus_1 = n - one
+
+    d = n_minus_1.copy()
+    s = np.zeros_like(n)
+    even = (d & one) == 0
+    while even.any():
+        d[even] >>= one
+        s[even] += one
+        even = (d & one) == 0
+
+    # right-to-left binary exponentiation of a^d mod n, all residues stay below 2^32
+    x = np.ones_like(n)
+    b = np.full_like(n, a)
+    while d.any():
+        odd = (d & one) == one
+        x = np.where(odd, x * b % n, x)
+        b = b * b % n
+        d >>= one
+
+    result = (x == one) | (x == n_minus_1)
+    for r in range(1, int(s.max())):
+        x = x * x % n
+        result |= (x == n_minus_1) & (s > np.uint64(r))
+    return result
+
+
+def mulhi_64(a, b):
+    """High 64 bits of the 128 bit products of two numpy uint64 arrays, computed on 32 bit limbs"""
+    low = np.uint64(0xFFFFFFFF)
+    half = np.uint64(32)
+    a0, a1 = a & low, a >> half
+    b0, b1 = b & low, b >> half
+    p01, p10 = a0 * b1, a1 * b0
+    mid = ((a0 * b0) >> half) + (p01 & low) + (p10 & low)
+    return a1 * b1 + (p01 >> half) + (p10 >> half) + (mid >> half)
+
+
+def montgomery_mul(a, b, n, n_inv):
+    """
+    Montgomery product a*b/2^64 mod n of numpy uint64 arrays with a, b < n, for odd n < 2^64 and n_inv = n^-1 mod 2^64.
+    m = a*b*n_inv makes the low words of a*b and m*n equal, so (a*b - m*n) / 2^64 is the difference of the high words
+    """
+    hi = mulhi_64(a, b)
+    mn = mulhi_64(a * b * n_inv, n)
+    return np.where(hi < mn, hi - mn + n, hi - mn)
+
+
+def is_strong_probable_prime_many_64(n, a : int):
+    """
+    Vectorized Miller-Rabin round over a numpy uint64 array of odd n with a < n < 2^64,
+    with residues in Montgomery form so every product fits in uint64 limbs.
+    Returns a boolean mask of the elements that are strong probable primes to base a.
+    """
+    one = np.uint64(1)
+    n_minus_1 = n - one
+
+    d = n_minus_1.copy()
+    s = np.zeros_like(n)
+    even = (d & one) == 0
+    while even.any():
+        d[even] >>= one
+        s[even] += one
+        even = (d & one) == 0
+
+    n_inv = n.copy() # n*n = 1 mod 8, every Newton step doubles the correct low bits
+    for _ in range(5):
+        n_inv *= np.uint64(2) - n * n_inv
+    r = (~n + one) % n # 2^64 mod n, the Montgomery form of 1
+    r2 = r.copy()      # 2^128 mod n, by doubling 64 times without overflowing
+    for _ in range(64):
+        r2 = np.where(r2 >= n - r2, r2 - (n - r2), r2 + r2)
+    minus_one = n - r
+
+    x = r
+    b = montgomery_mul(np.full_like(n, a), r2, n, n_inv)
+    while d.any():
+        odd = (d & one) == one
+        x = np.where(odd, montgomery_mul(x, b, n, n_inv), x)
+        b = montgomery_mul(b, b, n, n_inv)
+        d >>= one
+
+    result = (x == r) | (x == minus_one)
+    for i in range(1, int(s.max())):
+        x = montgomery_mul(x, x, n, n_inv)
+        result |= (x == minus_one) & (s > np.uint64(i))
+    return result
+
+
+def miller_rabin_many(n, bases, round) -> "np.ndarray":
+    """Runs the Miller-Rabin round of every base over the uint64 array n, each only on the values that passed the previous ones"""
+    alive = np.arange(n.size)
+    for a in bases:
+        if not alive.size:
+            break
+        alive = alive[round(n[alive], a)]
+    passed = np.zeros(n.shape, dtype=bool)
+    passed[alive] = True
+    return passed
+
+
+def integer_array(values) -> "np.ndarray":
+    """
+    Converts values to a numpy array of integers without passing through float64, which np.asarray does
+    for lists mixing small values with values >= 2^63: uint64 if every value fits in it, int64 if some are
+    negative, and an object array of python ints otherwise. Non integer values raise an exception.
+    """
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind in "iu":
+            return values
+        if values.dtype != object:
+            raise Exception("Primality is only defined for integers, got an array of {}".format(values.dtype))
+        shape, items = values.shape, values.ravel().tolist()
+    else:
+        shape, items = None, list(values)
+    if not all(isinstance(v, (int, np.integer)) for v in items):
+        raise Exception("Primality is only defined for integers")
+    items = [int(v) for v in items]
+    lo, hi = min(items, default=0), max(items, default=0)
+    if 0 <= lo and hi < 1 << 64:
+        dtype = np.uint64
+    elif -(1 << 63) <= lo and hi < 1 << 63:
+        dtype = np.int64
+    else:
+        dtype = object
+    arr = np.array(items, dtype=dtype)
+    return arr.reshape(shape) if shape is not None else arr
+
+
+def is_probable_prime_many(values):
+    """
+    Vectorized is_probable_prime over a numpy array of non-negative integers.
+    Values below 2^64 are tested in bulk, by trial division and Miller-Rabin rounds on uint64 arrays,
+    larger ones one by one.
+    """
+    values = integer_array(values)
+    result = np.zeros(values.shape, dtype=bool)
+    fits = values < 1 << 64 if values.dtype == object else np.ones(values.shape, dtype=bool)
+    for i in np.flatnonzero(~fits):
+        result[i] = is_probable_prime(int(values[i]))
+
+    idx = np.flatnonzero(fits)
+    n = values[idx].astype(np.uint64)
+    candidate = n >= np.uint64(2)
+    for p in TRIAL_PRIMES:
+        candidate &= (n % np.uint64(p) != 0) | (n == np.uint64(p))
+    # survivors below 1000^2 are primes, the rest need the Miller-Rabin rounds
+    large = np.flatnonzero(candidate & (n >= np.uint64(TRIAL_PRIMES[-1] ** 2)))
+    narrow = n[large] < np.uint64(1 << 32)
+    candidate[large[narrow]] = miller_rabin_many(n[large[narrow]], MR_BASES_32, is_strong_probable_prime_many)
+    candidate[large[~narrow]] = miller_rabin_many(n[large[~narrow]], MR_BASES_64, is_strong_probable_prime_many_64)
+    result[idx] = candidate
+    return result
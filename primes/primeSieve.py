@@ -1,48 +1,491 @@
 import math
+import mmap as mmap_module
+from multiprocessing import resource_tracker, shared_memory, util
+import operator
+import itertools as it
+import struct
+import sys
+import zlib
+from array import array
+
+from . import instrumentation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# available storage layouts of the sieve table:
+#   "list"   - plain python list, sieve[x] is the smallest prime factor of x or 0 if x is a prime
+#   "spf"    - same table as "list", but stored in an array of the narrowest unsigned type that fits
+#   "bitmap" - odd-only bit-packed table, bit i is set iff 2*i+1 is composite. Only answers primality,
+#              smallest prime factors of composites are recovered by trial division
+LAYOUTS = ("list", "spf", "bitmap")
+
+# sieve construction engines, "auto" picks numpy when it is installed
+ENGINES = ("auto", "python", "numpy")
+
+# binary sieve file format: a fixed size header followed by the raw table
+#   magic, format version, layout index in LAYOUTS, byte order (0 little, 1 big), array typecode,
+#   sieve size, table length in bytes, crc32 of the table
+SIEVE_FILE_MAGIC = b"PRMSIEVE"
+SIEVE_FILE_VERSION = 1
+SIEVE_FILE_HEADER = struct.Struct("<8sHBBcQQI")
+SIEVE_FILE_HEADER_SIZE = 64 # the table starts aligned to 64 bytes
+
+# a growable sieve grows at least by this factor when a query passes its size,
+# and by default never past this many bytes of table
+GROWTH_FACTOR = 2
+DEFAULT_MAX_BYTES = 1 << 28
+
+
+def spf_typecode(upto : int) -> str:
+    """
+    Returns the narrowest unsigned array typecode able to hold the smallest prime factor table up to upto.
+    The smallest prime factor of a composite x <= upto is at most isqrt(upto), so that is the largest stored value.
+    """
+    largest = math.isqrt(upto)
+    for typecode in "BHILQ":
+        if largest < 1 << (8 * array(typecode).itemsize):
+            return typecode
+    raise Exception("Sieve too large to be stored in an array")
+
+
+def table_size_limit(layout : str, max_bytes : int) -> int:
+    """Returns the largest sieve size whose table in the given layout fits in max_bytes, see PrimeSieve.nbytes"""
+    if layout == "list":
+        return max_bytes // 8 - 1
+    if layout == "bitmap":
+        return max_bytes * 16 - 1
+    # spf_typecode(size) has the smallest itemsize such that isqrt(size) fits in it
+    return max(min(max_bytes // array(typecode).itemsize - 1, (1 << (16 * array(typecode).itemsize)) - 1) for typecode in "BHILQ")
+
+
+def small_primes(upto : int) -> list[int]:
+    """Returns the list of all primes <= upto, using a plain sieve of Eratosthenes"""
+    if upto < 2:
+        return []
+    is_prime = bytearray([1]) * (upto + 1)
+    is_prime[0] = is_prime[1] = 0
+    for d in range(2, math.isqrt(upto) + 1):
+        if is_prime[d]:
+            is_prime[d*d::d] = bytes(len(range(d*d, upto+1, d)))
+    return [p for p in range(2, upto + 1) if is_prime[p]]
+
 
 class PrimeSieve:
     """
-    Allows to check the smallest prime factor of all numbers not exceeding sieve size
+    Allows to check the smallest prime factor of all numbers not exceeding sieve size.
+
+    A growable sieve extends itself when a table query passes its size, sieving only the new numbers,
+    to at least GROWTH_FACTOR times its size, as long as the table stays within max_bytes
+    (DEFAULT_MAX_BYTES by default). is_composite and smallest_prime_factor only grow it by one such step,
+    primes_upto and is_prime_many up to the queried number. Queries beyond that are answered as for a fixed size sieve.
     """
-    def __init__ (self, size : int, verbose : bool = False):
+    def __init__ (self, size : int, verbose : bool = False, layout : str = "spf", engine : str = "auto", *, growable : bool = False, max_bytes : int = None):
+        if layout not in LAYOUTS:
+            raise Exception("Unknown sieve layout '{}', expected one of {}".format(layout, LAYOUTS))
+        if engine not in ENGINES:
+            raise Exception("Unknown sieve engine '{}', expected one of {}".format(engine, ENGINES))
+        if engine == "numpy" and np is None:
+            raise Exception("numpy engine was requested but numpy is not installed")
         self.verbose = verbose
         self.size = size
-        self.sieve = self.make_sieve(upto=size)
+        self.layout = layout
+        self.engine = engine if engine != "auto" else ("numpy" if np is not None else "python")
+        self.growable = growable
+        self.size_limit = max(size, table_size_limit(layout, max_bytes if max_bytes is not None else DEFAULT_MAX_BYTES)) if growable else size
+        with instrumentation.timed("sieve.build"):
+            self.sieve = self.make_sieve(upto=size)
+
+    def make_sieve(self, upto : int):
+        """
+        Creates a table L such that L[x] is the smallest prime factor of x or 0 if x is a prime,
+        stored according to the layout of the sieve
+        """
+        if self.layout == "bitmap":
+            return self.make_bitmap(upto)
+        if self.engine == "numpy":
+            return self.make_sieve_numpy(upto)
+
+        if self.layout == "list":
+            sieve = [0] * (upto + 1)
+            fill = lambda d, count: [d] * count
+        else:
+            typecode = spf_typecode(upto)
+            sieve = array(typecode, bytes(array(typecode).itemsize * (upto + 1)))
+            fill = lambda d, count: array(typecode, [d]) * count
+
+        # marking from the largest prime down lets the smallest prime factor overwrite the others,
+        # and every composite x has spf(x)^2 <= x so starting from d*d is enough
+        for d in reversed(small_primes(math.isqrt(upto))):
+            sieve[d*d::d] = fill(d, len(range(d*d, upto+1, d)))
+        return sieve
+
+    def make_sieve_numpy(self, upto : int):
+        """
+        Same as make_sieve, but marks the multiples of each prime with a single strided numpy assignment.
+        The table is sieved in place through a zero-copy view of the array
+        """
+        typecode = spf_typecode(upto)
+        sieve = array(typecode, bytes(array(typecode).itemsize * (upto + 1)))
+        view = np.frombuffer(sieve, dtype=np.dtype(typecode))
+        for d in reversed(small_primes(math.isqrt(upto))):
+            view[d*d::d] = d
+        del view # release the buffer export so the array stays resizable
+
+        if self.layout == "list":
+            return sieve.tolist()
+        return sieve
+
+    def make_bitmap(self, upto : int) -> bytes:
+        """
+        Creates an odd-only bit-packed table where bit i is set iff 2*i+1 is composite (or equal to 1)
+        """
+        n_odd = upto // 2 + 1 # odd numbers 1, 3, ..., (rounded up) upto
+        n_odd += -n_odd % 8   # pad to whole bytes
+        return self.make_bitmap_segment(0, 2 * n_odd, small_primes(math.isqrt(upto)))
+
+    def make_bitmap_segment(self, lo : int, hi : int, primes : list[int]) -> bytes:
+        """
+        Creates the bytes of the bitmap table covering the odd numbers in [lo, hi), both multiples of 16,
+        with the multiples of the given primes marked composite
+        """
+        n_odd = (hi - lo) // 2
+        composite = bytearray(n_odd)
+        if lo == 0:
+            composite[0] = 1
+        starts = []
+        for d in primes[1:] if primes[:1] == [2] else primes:
+            start = max(d*d, -(-lo // d) * d)
+            start += d * (start % 2 == 0) # first odd multiple
+            starts.append(((start - lo) // 2, d))
+
+        if self.engine == "numpy":
+            view = np.frombuffer(composite, dtype=np.uint8)
+            for i, d in starts:
+                view[i::d] = 1
+            return np.packbits(view, bitorder="little").tobytes()
+
+        for i, d in starts:
+            composite[i::d] = b"\x01" * len(range(i, n_odd, d))
+
+        # every byte of the sliced tables is 0 or 1, so shifting the whole integer by j < 8 bits
+        # moves each flag into bit j of its own byte without carrying into the neighbours
+        packed = 0
+        for j in range(8):
+            packed |= int.from_bytes(composite[j::8], "little") << j
+        return packed.to_bytes(n_odd // 8, "little")
+
+    def extend(self, upto : int) -> None:
+        """Grows the sieve to size upto, sieving only the numbers above the current size"""
+        if upto <= self.size:
+            return
+        if isinstance(self.sieve, memoryview):
+            raise Exception("Sieves loaded from files or shared memory cannot be extended")
+        with instrumentation.timed("sieve.extend"):
+            primes = small_primes(math.isqrt(upto))
+
+            if self.layout == "bitmap":
+                keep = (self.size + 1) // 16 # bytes whose numbers are all <= size, the last partial byte is sieved again
+                hi = 16 * -(-(upto + 1) // 16)
+                self.sieve = bytes(self.sieve[:keep]) + self.make_bitmap_segment(16 * keep, hi, primes)
+                self.size = upto
+                return
 
-    def make_sieve(self, upto : int) -> list:
+            lo, hi = self.size + 1, upto + 1
+            typecode = spf_typecode(upto)
+            segment = array(typecode, bytes(array(typecode).itemsize * (hi - lo)))
+            view = np.frombuffer(segment, dtype=np.dtype(typecode)) if self.engine == "numpy" else None
+            for d in reversed(primes):
+                start = max(d*d, -(-lo // d) * d)
+                if start >= hi:
+                    continue
+                if view is not None:
+                    view[start-lo::d] = d
+                else:
+                    segment[start-lo::d] = array(typecode, [d]) * len(range(start, hi, d))
+            del view
+
+            if self.layout == "list":
+                self.sieve.extend(segment)
+            else:
+                if self.sieve.typecode != typecode:
+                    self.sieve = array(typecode, self.sieve) # widen, the largest smallest prime factor outgrew the type
+                self.sieve.extend(segment)
+            self.size = upto
+
+    def covers(self, x : int, *, within_step : bool = False) -> bool:
         """
-        Creates a list L such that L[x] is the biggest prime factor of x or 0 if x is a prime 
+        Returns True iff x <= size, after growing a growable sieve to cover x if that keeps the table
+        within its memory ceiling. With within_step it only grows if x <= GROWTH_FACTOR * size,
+        so a single far query does not sieve every number below it
         """
-        sieve = [0] * (upto + 1)
-        for d in range(2, math.isqrt(upto) + 1):
-            if sieve[d]:
-                continue
+        if x <= self.size:
+            return True
+        if not self.growable or x > self.size_limit or (within_step and x > self.size * GROWTH_FACTOR):
+            return False
+        self.extend(min(max(x, self.size * GROWTH_FACTOR), self.size_limit))
+        return True
 
-            for d_mult in range(2*d, upto+1, d):
-                if not sieve[d_mult]:
-                    sieve[d_mult] = d
-        return sieve 
+    def is_composite(self, x : int) -> bool:
+        """Returns True iff 2 <= x <= size is composite"""
+        if x > self.size and not self.covers(x, within_step=True):
+            raise Exception("Number greater than sieve size")
+        if self.layout == "bitmap":
+            if x & 1 == 0:
+                return x != 2
+            i = x >> 1
+            return bool(self.sieve[i >> 3] >> (i & 7) & 1)
+        return self.sieve[x] != 0
+
+    def is_prime_many(self, xs):
+        """
+        Vectorized primality lookup for a numpy integer array of values 0 <= x <= size,
+        done as a single gather on the sieve table. Returns a boolean mask
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        if xs.size and self.growable:
+            self.covers(int(xs.max()))
+        if self.layout == "bitmap":
+            bits = np.frombuffer(self.sieve, dtype=np.uint8)
+            i = xs >> 1
+            composite = ((bits[i >> 3] >> (i & 7)) & 1).astype(bool)
+            composite = np.where(xs & 1 == 0, xs != 2, composite)
+        elif self.layout == "list":
+            # converting the whole list would cost more than the lookups, only the requested entries are read
+            composite = np.fromiter(map(self.sieve.__getitem__, xs.tolist()), dtype=np.int64, count=xs.size) != 0
+        else:
+            composite = np.asarray(self.sieve)[xs] != 0 # zero-copy view through the buffer protocol
+        return ~composite & (xs >= 2)
 
     def smallest_prime_factor(self, x : int) -> int:
         if x < 0:
             raise Exception("Negative number was supplied")
         if x <= 1:
             return x
-        if x <= self.size:
+        if x > self.size and self.growable:
+            self.covers(x, within_step=True)
+        stats = instrumentation.STATS
+        if x <= self.size and self.layout != "bitmap":
+            if stats is not None:
+                stats.count("sieve.spf.table")
             a = self.sieve[x]
             return x if a == 0 else a
+        if x <= self.size and not self.is_composite(x):
+            if stats is not None:
+                stats.count("sieve.spf.table")
+            return x
+        if stats is not None:
+            stats.count("sieve.spf.trial_division")
 
         if x <= self.size**2:
             for p in range(2, math.isqrt(x)+1):
-                if self.sieve[p]:
+                if self.is_composite(p):
                     continue # skip all composite numbers
                 if x % p == 0:
                     return p
             # if nothing was returned by now it means that no prime <=sqrt(x) divides x,
             # therefore x is prime and is the smallest prime factor of itself
             return x
-        
+
         else:
             raise Exception("Number greater than sieve size squared")
 
-        
\ No newline at end of file
+    def primes_upto(self, n : int) -> list[int]:
+        """Returns the list of all primes <= n, read directly from the sieve table. n must be covered by the sieve"""
+        if n > self.size and not self.covers(n):
+            raise Exception("Number greater than sieve size")
+        if self.layout == "bitmap":
+            return [p for p in range(2, n+1) if not self.is_composite(p)]
+        return list(it.compress(range(2, n+1), map(operator.not_, it.islice(self.sieve, 2, n+1))))
+
+    def table_payload(self) -> tuple[str, str, memoryview]:
+        """
+        Returns (layout, typecode, payload), the raw bytes of the sieve table as written by save and to_shared.
+        A list layout is converted to its "spf" array.
+        """
+        if self.layout == "list":
+            typecode = spf_typecode(self.size)
+            return "spf", typecode, memoryview(array(typecode, self.sieve)).cast("B")
+        if self.layout == "bitmap":
+            return "bitmap", "B", memoryview(self.sieve).cast("B")
+        # tables loaded from files or shared memory are memoryviews, whose format is the array typecode
+        typecode = self.sieve.format if isinstance(self.sieve, memoryview) else self.sieve.typecode
+        return "spf", typecode, memoryview(self.sieve).cast("B")
+
+    def table_header(self) -> tuple[bytes, memoryview]:
+        """Returns the SIEVE_FILE_HEADER_SIZE bytes header describing the table, and the table payload"""
+        layout, typecode, payload = self.table_payload()
+        header = SIEVE_FILE_HEADER.pack(SIEVE_FILE_MAGIC, SIEVE_FILE_VERSION, LAYOUTS.index(layout),
+                                        sys.byteorder == "big", typecode.encode(), self.size, len(payload), zlib.crc32(payload))
+        return header.ljust(SIEVE_FILE_HEADER_SIZE, b"\0"), payload
+
+    @staticmethod
+    def parse_header(header, source : str) -> tuple[str, str, bool, int, int, int]:
+        """Unpacks a header written by table_header into (layout, typecode, swap, size, length, checksum)"""
+        if len(header) < SIEVE_FILE_HEADER_SIZE:
+            raise Exception("Not a sieve file: {}".format(source))
+        magic, version, layout, big_endian, typecode, size, length, checksum = SIEVE_FILE_HEADER.unpack_from(header)
+        if magic != SIEVE_FILE_MAGIC:
+            raise Exception("Not a sieve file: {}".format(source))
+        if version != SIEVE_FILE_VERSION:
+            raise Exception("Unsupported sieve file version {}, expected {}".format(version, SIEVE_FILE_VERSION))
+        typecode = typecode.decode()
+        swap = big_endian != (sys.byteorder == "big") and typecode != "B"
+        return LAYOUTS[layout], typecode, swap, size, length, checksum
+
+    @classmethod
+    def from_table(cls, size : int, layout : str, table) -> "PrimeSieve":
+        """Builds a sieve around an already sieved table, which can be any buffer indexed like the layout's table"""
+        sieve = cls.__new__(cls)
+        sieve.verbose = False
+        sieve.size = size
+        sieve.layout = layout
+        sieve.engine = "python"
+        sieve.growable = False
+        sieve.size_limit = size
+        sieve.sieve = table
+        return sieve
+
+    def save(self, path : str) -> None:
+        """
+        Writes the sieve to path in the versioned binary format described by SIEVE_FILE_HEADER.
+        A list layout is stored as its "spf" array, and is loaded back as such.
+        """
+        header, payload = self.table_header()
+        with open(path, "wb") as f:
+            f.write(header)
+            f.write(payload)
+
+    @classmethod
+    def load(cls, path : str, mmap : bool = True, verify : bool = None) -> "PrimeSieve":
+        """
+        Loads a sieve written by save.
+
+        Args:
+            path: the sieve file.
+            mmap: map the table read-only into memory instead of reading it, so loading takes no time
+                and every process loading the same file shares its pages in the page cache.
+            verify: check the crc32 of the table, which reads all of it. Defaults to True unless mmap is used.
+        """
+        if verify is None:
+            verify = not mmap
+        with open(path, "rb") as f:
+            layout, typecode, swap, size, length, checksum = cls.parse_header(f.read(SIEVE_FILE_HEADER_SIZE), path)
+            if mmap:
+                if swap:
+                    raise Exception("Sieve file was written with a different byte order, load it with mmap=False")
+                mapped = mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ)
+                payload = memoryview(mapped)[SIEVE_FILE_HEADER_SIZE:SIEVE_FILE_HEADER_SIZE + length]
+            else:
+                payload = f.read(length)
+        if len(payload) != length:
+            raise Exception("Sieve file is truncated: {}".format(path))
+        if verify and zlib.crc32(payload) != checksum:
+            raise Exception("Sieve file checksum mismatch: {}".format(path))
+
+        if mmap:
+            sieve = cls.from_table(size, layout, payload if layout == "bitmap" else payload.cast(typecode))
+            sieve._mmap = mapped # keeps the mapping alive as long as the sieve
+            sieve._path = path   # pickled as a reference to the file, see __reduce_ex__
+            return sieve
+        if layout == "bitmap":
+            return cls.from_table(size, layout, payload)
+        table = array(typecode, payload)
+        if swap:
+            table.byteswap()
+        return cls.from_table(size, layout, table)
+
+    def to_shared(self) -> "PrimeSieve":
+        """
+        Copies the sieve table into a new multiprocessing.shared_memory segment and returns a sieve reading it.
+        Pickling the returned sieve only sends the segment name, so every process of a pool it is passed to
+        attaches to the same physical copy. The returned sieve owns the segment, which is removed by its close_shared.
+        """
+        header, payload = self.table_header()
+        shm = shared_memory.SharedMemory(create=True, size=SIEVE_FILE_HEADER_SIZE + len(payload))
+        shm.buf[:SIEVE_FILE_HEADER_SIZE] = header
+        shm.buf[SIEVE_FILE_HEADER_SIZE:SIEVE_FILE_HEADER_SIZE + len(payload)] = payload
+        sieve = PrimeSieve.attach_shared(shm.name, _shm=shm)
+        sieve._owner = True
+        return sieve
+
+    @classmethod
+    def attach_shared(cls, name : str, *, _shm = None) -> "PrimeSieve":
+        """Returns a read-only sieve backed by the shared memory segment created by to_shared under the given name"""
+        if _shm is None:
+            try:
+                _shm = shared_memory.SharedMemory(name, track=False) # python 3.13+, the creator alone removes the segment
+            except TypeError:
+                _shm = shared_memory.SharedMemory(name)
+                # before python 3.13 attaching registers the segment with this process's resource tracker,
+                # which would unlink it when this process exits, see close_shared
+                resource_tracker.unregister(_shm._name, "shared_memory")
+        layout, typecode, _, size, length, _ = cls.parse_header(_shm.buf[:SIEVE_FILE_HEADER_SIZE], name)
+        payload = _shm.buf[SIEVE_FILE_HEADER_SIZE:SIEVE_FILE_HEADER_SIZE + length].toreadonly()
+        sieve = cls.from_table(size, layout, payload if layout == "bitmap" else payload.cast(typecode))
+        sieve._shm = _shm
+        sieve._owner = False
+        return sieve
+
+    def close_shared(self) -> None:
+        """
+        Detaches the sieve from its shared memory segment, and removes the segment if this sieve created it.
+        Closing again, or after the segment was removed by another process, does nothing more.
+        """
+        if not hasattr(self, "_shm"):
+            raise Exception("Sieve is not in shared memory")
+        shm = self._shm
+        if shm is None:
+            return
+        if isinstance(self.sieve, memoryview):
+            self.sieve.release()
+        self.sieve = None
+        self._shm = None
+        shm.close()
+        if self._owner:
+            # a process attached before python 3.13 may share the tracker of this one and have unregistered
+            # the segment, registering again (a no-op otherwise) keeps the unregistering of unlink balanced
+            if sys.version_info < (3, 13):
+                resource_tracker.register(shm._name, "shared_memory")
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                resource_tracker.unregister(shm._name, "shared_memory") # already removed, unlink did not unregister it
+
+    def __reduce_ex__(self, protocol):
+        # shared and memory mapped tables are pickled as references, everything else is copied
+        if getattr(self, "_shm", None) is not None:
+            return attached_sieve, (self._shm.name,)
+        if getattr(self, "_mmap", None) is not None:
+            return PrimeSieve.load, (self._path,)
+        return super().__reduce_ex__(protocol)
+
+    def nbytes(self) -> int:
+        """Approximate size of the sieve table in bytes"""
+        if self.layout == "list":
+            return len(self.sieve) * 8
+        if self.layout == "bitmap":
+            return len(self.sieve)
+        return len(self.sieve) * self.sieve.itemsize
+
+
+# sieves attached by unpickling in this process, by segment name, so a worker attaches once per segment
+ATTACHED_SIEVES = {}
+
+def attached_sieve(name : str) -> PrimeSieve:
+    """Unpickles a shared sieve, attaching to its segment on first use"""
+    if name not in ATTACHED_SIEVES:
+        if not ATTACHED_SIEVES:
+            # run at exit of the main process and of pool workers alike, unlike atexit
+            util.Finalize(None, close_attached_sieves, exitpriority=0)
+        ATTACHED_SIEVES[name] = PrimeSieve.attach_shared(name)
+    return ATTACHED_SIEVES[name]
+
+def close_attached_sieves() -> None:
+    """Detaches the sieves of ATTACHED_SIEVES, releasing their views of the segments before the segments are closed"""
+    while ATTACHED_SIEVES:
+        _, sieve = ATTACHED_SIEVES.popitem()
+        if sieve.sieve is not None:
+            sieve.close_shared()
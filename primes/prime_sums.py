@@ -1,25 +1,49 @@
 import math
 import itertools as it
-import functools as ft
-import operator
 
-from .primes_utils import check_prime, prime_list
 from .primeSieve import PrimeSieve
+from .segmented_sieve import sum_primes_in_range
+from .lucy import LucyTable
 
 def brute(N : int, sieve : PrimeSieve = None) -> int:
     """
-    Computes the sum of prime list upto N
+    Computes the sum of prime list upto N, sieving [2, N] segment by segment
     """
-    if sieve is None or sieve.size < N:
-        sieve = PrimeSieve(N)
-    
-    return sum(prime_list(sieve, upto=N))
+    return sum_primes_in_range(2, N+1, sieve)
+
+def prime_sum(N : int, k : int = 1, mod : int = None, *, f = None, prefix = None, table : bool = False, engine : str = "auto", workers : int = None):
+    """
+    Computes the sum of p^k over the primes p <= N with the Lucy_Hedgehog sieve.
+
+    Args:
+        N: upper bound of the summed primes.
+        k: power of the primes, k = 0 counts them.
+        mod: if given, the sum is computed modulo mod, in machine ints when mod^2 < 2^62.
+        f, prefix: sum f(p) for a completely multiplicative f instead of p^k,
+            prefix(v) must return sum(f(n) for 1 <= n <= v).
+        table: return the whole lucy.LucyTable, holding the sums at every v = N // i, instead of the sum at N.
+        engine: "auto", "python" or "numpy", see lucy.LucyTable.
+        workers: number of processes sharing the sieving of the numpy engine, see lucy.LucyTable.
+    """
+    lucy_table = LucyTable(N, k, mod, engine, f=f, prefix=prefix, workers=workers)
+    return lucy_table if table else lucy_table[N]
 
 S_ref = {100: 1060, 50: 328, 33: 160, 25: 100, 20: 77, 16: 41, 14: 41, 12: 28, 11: 28, 10: 17, 9: 17, 8: 17, 7: 17, 6: 10, 5: 10, 4: 5, 3: 5, 2: 2, 1: 0}
 
 
 
-def lucy_Hedgehog_method(N : int) -> int: #by Lucy_Hedgehog, https://projecteuler.net/thread=10;page=5
+def lucy_Hedgehog_method(N : int, debug : bool = False) -> int: #by Lucy_Hedgehog, https://projecteuler.net/thread=10;page=5
+    """
+    Computes the sum of primes <= N.
+    By default the array based lucy.LucyTable engine is used, with no checks in the hot loop.
+    With debug=True the reference implementation runs instead, validating V and the sieve invariant after every prime.
+    """
+    if not debug:
+        return prime_sum(N, k=1)
+    return lucy_Hedgehog_method_validated(N)
+
+def lucy_Hedgehog_method_validated(N : int) -> int:
+    """Reference dict based implementation of lucy_Hedgehog_method, with all its assertions"""
     r = math.isqrt(N)
     assert r*r <= N and (r+1)**2 > N # make sure r really is the integer square root of N
 
@@ -28,7 +52,7 @@ def lucy_Hedgehog_method(N : int) -> int: #by Lucy_Hedgehog, https://projecteule
 
     V = list(it.chain(div_results, range(div_results[-1]-1,0,-1)))
 
-    assert V[r-1:] == list(range(r, 0, -1)) #the (r-1)th element is N//r = r by definition of integer square root
+    assert V[-r:] == list(range(r, 0, -1)) # N//r >= r, so V always ends with r, r-1, ..., 1
     assert all([V[i] > V[i+1] for i in range(0, len(V) - 2)]) # V is strictly decreasing
 
     # helper function
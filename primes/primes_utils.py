@@ -1,7 +1,12 @@
+from typing import Iterator
 import itertools as it
+import bisect
 import math
 
-from .primeSieve import PrimeSieve
+from .primeSieve import PrimeSieve, np
+from .primality import is_probable_prime, is_probable_prime_many, integer_array, TRIAL_PRIMES
+from .segmented_sieve import primes_in_range, iter_primes, segments
+from . import instrumentation
 
 # very very low quality, needs improvement
 def next_prime_brute(n : int, prime_sieve : PrimeSieve) -> int:
@@ -16,88 +21,254 @@ def next_prime_brute(n : int, prime_sieve : PrimeSieve) -> int:
     
     return n
 
-def next_prime(n: int, prime_sieve: PrimeSieve) -> int:
-    """Returns the smallest prime greater than `from`"""
-    return next_prime_brute(n, prime_sieve)
+# residues mod 30 of the numbers not divisible by 2, 3 or 5
+WHEEL_RESIDUES = (1, 7, 11, 13, 17, 19, 23, 29)
 
-def check_prime(num : int, prime_sieve : PrimeSieve) -> bool:
+def wheel_up(start : int) -> Iterator[int]:
+    """Yields the numbers c >= start not divisible by 2, 3 or 5, in increasing order"""
+    for base in it.count(start - start % 30, 30):
+        for r in WHEEL_RESIDUES:
+            if base + r >= start:
+                yield base + r
+
+def wheel_down(start : int) -> Iterator[int]:
+    """Yields the numbers 0 < c <= start not divisible by 2, 3 or 5, in decreasing order"""
+    for base in range(start - start % 30, -1, -30):
+        for r in reversed(WHEEL_RESIDUES):
+            if 0 < base + r <= start:
+                yield base + r
+
+def prime_window_width(n : int) -> int:
+    """Length of the window sieved at a time past the sieve bound, a few times the average prime gap near n"""
+    return max(256, 32 * n.bit_length())
+
+def window_primes(lo : int, hi : int) -> Iterator[int]:
+    """
+    Yields the primes in [lo, hi) in increasing order. The window is sieved by the small trial primes
+    and the survivors are confirmed with is_probable_prime unless the sieving alone was exact
+    """
+    limit = math.isqrt(max(hi - 1, 0))
+    exact = limit <= TRIAL_PRIMES[-1]
+    base = TRIAL_PRIMES[:bisect.bisect(TRIAL_PRIMES, limit)] if exact else TRIAL_PRIMES
+    for seg_lo, flags in segments(lo, hi, segment_size=hi-lo, _base_primes=base):
+        for c in it.compress(range(seg_lo, seg_lo + len(flags)), flags):
+            if exact or is_probable_prime(c):
+                yield c
+
+def next_prime(n: int, prime_sieve: PrimeSieve = None) -> int:
+    """
+    Returns the smallest prime greater than n.
+    Inside the sieve candidates are taken from a mod 30 wheel and looked up in the sieve table,
+    past the sieve a short window is sieved by small primes and its survivors are tested for primality.
+    """
+    if n < 5:
+        return 2 if n < 2 else (3 if n == 2 else 5)
+
+    if prime_sieve is not None and n < prime_sieve.size:
+        for c in wheel_up(n + 1):
+            if c > prime_sieve.size:
+                break
+            if not prime_sieve.is_composite(c):
+                return c
+        n = prime_sieve.size
+
+    width = prime_window_width(n)
+    for lo in it.count(n + 1, width):
+        for p in window_primes(lo, lo + width):
+            return p
+
+def prev_prime(n: int, prime_sieve: PrimeSieve = None) -> int:
+    """Returns the largest prime smaller than n, see next_prime"""
+    if n <= 7:
+        if n <= 2:
+            raise Exception("There is no prime smaller than 2")
+        return {3: 2, 4: 3, 5: 3, 6: 5, 7: 5}[n]
+
+    if prime_sieve is not None and n - 1 <= prime_sieve.size:
+        for c in wheel_down(n - 1):
+            if c < 7:
+                break
+            if not prime_sieve.is_composite(c):
+                return c
+        return 5
+
+    width = prime_window_width(n)
+    for hi in range(n, 0, -width):
+        lo = max(hi - width, 0)
+        if prime_sieve is not None and hi - 1 <= prime_sieve.size:
+            return prev_prime(hi, prime_sieve)
+        window = list(window_primes(lo, hi))
+        if window:
+            return window[-1]
+
+def check_prime(num : int, prime_sieve : PrimeSieve = None) -> bool:
+    """
+    Checks primality of num with a lookup in the sieve table if num <= prime_sieve.size,
+    and with the sieve independent Miller-Rabin / BPSW test otherwise, which is cheaper than growing a growable sieve
+    """
     if num < 0:
         raise Exception("Checking primality of number below 0")
     if num <= 1:
         return False
-    if num <= prime_sieve.size**2:
-        return prime_sieve.smallest_prime_factor(num) == num
-    else:
-        raise Exception("Number larger than sieve size squared, can't check for primality")
+    stats = instrumentation.STATS
+    if prime_sieve is not None and num <= prime_sieve.size:
+        if stats is not None:
+            stats.count("check_prime.table")
+        return not prime_sieve.is_composite(num)
+    if stats is not None:
+        stats.count("check_prime.probable_prime")
+    return is_probable_prime(num)
 
 
-    
+def check_prime_many(values, prime_sieve : PrimeSieve = None):
+    """
+    Checks primality of every number in values, which can be a list, an array or a numpy array.
+    With numpy installed, values <= prime_sieve.size are answered by one gather on the sieve table
+    and the rest by a batched Miller-Rabin test.
 
-def prime_list(prime_sieve : PrimeSieve, *, upto : int = None, n : int = None):
+    Returns:
+        a numpy boolean mask if values is a numpy array, otherwise a list of bools
+    """
+    if np is None:
+        return [check_prime(v, prime_sieve) for v in values]
+
+    arr = integer_array(values)
+    if arr.size and arr.min() < 0:
+        raise Exception("Checking primality of number below 0")
+
+    mask = np.zeros(arr.shape, dtype=bool)
+    in_sieve = arr <= prime_sieve.size if prime_sieve is not None else mask.copy()
+    if in_sieve.any():
+        mask[in_sieve] = prime_sieve.is_prime_many(arr[in_sieve])
+    if not in_sieve.all():
+        mask[~in_sieve] = is_probable_prime_many(arr[~in_sieve])
+
+    return mask if isinstance(values, np.ndarray) else mask.tolist()
+
+
+def prime_list(prime_sieve : PrimeSieve, *, upto : int = None, n : int = None, workers : int = None):
     """
     Returns a list of primes p <= upto if 'upto' keyword argument is supplied,
     or the list of first n primes if 'n' keyword argument is supplied.
     Precisely one of 'upto' and 'n' keyword args must be supplied, otherwise an error is raised.
+    Primes up to 'upto' are produced by a segmented sieve, so 'upto' is not bounded by the sieve size,
+    and the segments are split over workers processes if given.
+    The first n primes are sieved up to the upper bound of nth_prime_bounds.
     """
     if not ((upto is None) ^ (n is None)):
         raise Exception("precisely one of upto or n keyword arguments must be supplied")
 
-    prime_list = []
-
-    if upto:
-        if upto >= 2:
-            prime_list.append(2)
-        for i in range(3, upto+1, 2):
-            if check_prime(i, prime_sieve):
-                prime_list.append(i)
-    else:
-        if n >= 1:
-            prime_list.append(2)
-        
-        i = 3
-        while len(prime_list) < n:
-            if check_prime(i, prime_sieve):
-                prime_list.append(i)
-            i += 2
-    
-    return prime_list
+    if upto is not None:
+        return primes_in_range(2, upto+1, prime_sieve, workers=workers)
 
-# rolling sieve
+    if n < 1:
+        return []
+    return primes_in_range(2, nth_prime_bounds(n)[1] + 1, prime_sieve, workers=workers)[:n]
+
+# rolling sieve, kept for compatibility; iter_primes streams the same primes from segmented blocks
 def psieve():
-    yield from (2, 3, 5, 7)
-    sieve_dict = {}
-    ps = psieve()
-    next(ps)        # drop the initial 2 from the helper psieve
-    p = next(ps)    # p = 3
-    psq = p*p  
-    for c in it.count(9, 2):  # start from 3^2, skip all evens
-        if c in sieve_dict:      # means that c is composite - WHY?
-            step = sieve_dict.pop(c)
-        elif c < psq:   # prime
-            yield c
-            continue
-        else:           # composite, = p*p
-            assert c == psq
-            step = 2*p
-            p = next(ps)
-            psq = p*p
-        
-        c += step
-        while c in sieve_dict:
-            c += step
-        sieve_dict[c] = step
-
-
-def nth_prime(n : int, prime_sieve : PrimeSieve) -> int:
-    """Returns the nth prime. SUPER SLOW"""
-    if n == 1:
-        return 2
-    
-    i = 1
-    for d in it.count(3, step=2):
-        if not check_prime(d, prime_sieve):
-            continue
-        i += 1
-        if i == n:
-            return d
+    return iter_primes()
+
+
+def log_integral(x : float) -> float:
+    """li(x) for x > 1, by Ramanujan's series"""
+    L = math.log(x)
+    term = L    # (-1)^(k-1) L^k / (k! 2^(k-1))
+    inner = 1.0 # sum(1 / (2j + 1) for 0 <= j <= (k - 1) // 2)
+    total = term * inner
+    for k in range(2, 1000):
+        term *= -L / (2 * k)
+        if k % 2 == 1:
+            inner += 1 / k
+        total += term * inner
+        if abs(term) * inner < 1e-17 * abs(total):
+            break
+    return 0.5772156649015329 + math.log(L) + math.sqrt(x) * total
+
+def moebius(m : int) -> int:
+    result = 1
+    for p in TRIAL_PRIMES:
+        if p > m:
+            break
+        if m % (p * p) == 0:
+            return 0
+        if m % p == 0:
+            result = -result
+    return result
+
+def riemann_r(x : float) -> float:
+    """Riemann's R(x) = sum(mu(m) / m * li(x^(1/m))), an estimate of pi(x) within about sqrt(x) / log(x)"""
+    total = 0.0
+    for m in it.count(1):
+        root = x ** (1 / m)
+        if root < 2:
+            return total
+        mu = moebius(m)
+        if mu:
+            total += mu / m * log_integral(root)
+
+# above this bound nth_prime_bounds uses the tighter bounds of Dusart (2010), which hold from n = 688383 on
+DUSART_MIN = 688383
+
+def nth_prime_bounds(n : int) -> tuple[int, int]:
+    """
+    Returns (lower, upper) with lower <= p_n <= upper, from the bounds of Rosser and Dusart:
+        p_n >= n(log n + log log n - 1 + (log log n - 2.1) / log n)  for n >= 3,
+        p_n <= n(log n + log log n - 1 + (log log n - 2) / log n)    for n >= DUSART_MIN,
+        p_n <  n(log n + log log n)                                 for n >= 6.
+    """
+    if n < 6:
+        p = (2, 3, 5, 7, 11)[n-1]
+        return p, p
+    L, LL = math.log(n), math.log(math.log(n))
+    lower = n * (L + LL - 1 + (LL - 2.1) / L)
+    upper = n * (L + LL - 1 + (LL - 2) / L) if n >= DUSART_MIN else n * (L + LL)
+    slack = 1 + 1e-12 # float rounding of the bounds
+    return max(int(lower / slack) - 1, 2), int(upper * slack) + 1
+
+# below this bound on p_n, nth_prime sieves all primes up to it instead of counting
+NTH_PRIME_SIEVE_MAX = 1 << 20
+
+def nth_prime(n : int, prime_sieve : PrimeSieve = None) -> int:
+    """
+    Returns the nth prime, p_1 = 2.
+    An estimate x of p_n is taken from the inverse of Riemann's R function and clamped to nth_prime_bounds,
+    pi(x) is computed by pi_computations.prime_pi and the short gap between x and p_n is sieved.
+    The optional sieve supplies the base primes of the sieved windows.
+    """
+    if n < 1:
+        raise Exception("n must be positive")
+    lower, upper = nth_prime_bounds(n)
+    if upper <= NTH_PRIME_SIEVE_MAX:
+        return primes_in_range(2, upper + 1, prime_sieve)[n-1]
+
+    from .pi_computations import prime_pi # pi_computations imports this module
+
+    x = n * math.log(n)
+    for _ in range(100): # Newton iterations on R(x) = n, as R'(x) is about 1 / log(x)
+        step = (riemann_r(x) - n) * math.log(x)
+        x -= step
+        if abs(step) < 1:
+            break
+    x = min(max(int(x), lower), upper)
+
+    count = prime_pi(x)
+    width = max(1 << 16, 2 * abs(n - count) * math.ceil(math.log(x)))
+    if count < n:
+        # p_n is the (n - count)th prime above x
+        lo = x + 1
+        while True:
+            window = primes_in_range(lo, lo + width, prime_sieve)
+            if count + len(window) >= n:
+                return window[n - count - 1]
+            count += len(window)
+            lo += width
 
+    # p_n is the (count - n + 1)th prime at or below x, counting down
+    hi = x + 1
+    while True:
+        window = primes_in_range(max(hi - width, 2), hi, prime_sieve)
+        if count - len(window) < n:
+            return window[n - count - 1]
+        count -= len(window)
+        hi -= width
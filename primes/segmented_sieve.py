@@ -0,0 +1,279 @@
+from typing import Iterator
+import itertools as it
+import bisect
+import math
+from array import array
+
+from .primeSieve import PrimeSieve, small_primes, np
+from . import parallel
+from . import instrumentation
+
+# numbers sieved per block, small enough for the block to stay in L2 cache
+SEGMENT_SIZE = 1 << 18
+
+# blocks sieved per task in parallel mode, enough work to amortize sending the task and its result
+PARALLEL_BLOCKS = 64
+
+# chunk types yielded by the streaming generators in batch mode
+BATCH_MODES = (None, "array", "numpy")
+
+
+def base_primes(hi : int, prime_sieve : PrimeSieve = None) -> list[int]:
+    """
+    Returns all primes p with p*p < hi, which is every prime needed to sieve numbers below hi.
+    They are read from prime_sieve if it is large enough, otherwise a base sieve up to isqrt(hi) is built.
+    """
+    limit = math.isqrt(max(hi - 1, 0))
+    if prime_sieve is not None and prime_sieve.size >= limit:
+        return prime_sieve.primes_upto(limit)
+    return small_primes(limit)
+
+
+def segments(lo : int, hi : int, prime_sieve : PrimeSieve = None, *, segment_size : int = None, _base_primes : list[int] = None) -> Iterator[tuple[int, bytearray]]:
+    """
+    Sieves the range [lo, hi) block by block.
+
+    Args:
+        lo, hi: bounds of the sieved range, lo inclusive, hi exclusive.
+        prime_sieve: optional sieve to take the base primes from.
+        segment_size: numbers per block, defaults to max(SEGMENT_SIZE, isqrt(hi)).
+
+    Yields:
+        pairs (seg_lo, flags) such that flags[i] == 1 iff seg_lo + i is prime.
+        Blocks are yielded in increasing order and together cover [lo, hi).
+    """
+    lo = max(lo, 0)
+    if hi <= lo:
+        return
+    if segment_size is None:
+        segment_size = max(SEGMENT_SIZE, math.isqrt(hi))
+    if _base_primes is None:
+        _base_primes = base_primes(hi, prime_sieve)
+
+    zeros = memoryview(bytes(segment_size))
+    stats = instrumentation.STATS
+    for seg_lo in range(lo, hi, segment_size):
+        if stats is not None:
+            stats.count("segments.blocks")
+        seg_hi = min(seg_lo + segment_size, hi)
+        flags = bytearray([1]) * (seg_hi - seg_lo)
+        for x in range(seg_lo, min(seg_hi, 2)): # 0 and 1 are not primes
+            flags[x - seg_lo] = 0
+
+        for p in _base_primes:
+            if p*p >= seg_hi:
+                break
+            start = max(p*p, -(-seg_lo // p) * p) # first multiple of p in the block that is not p itself
+            count = len(range(start, seg_hi, p))
+            flags[start - seg_lo::p] = zeros[:count]
+        yield seg_lo, flags
+
+
+def flags_sum(seg_lo : int, flags : bytearray) -> int:
+    """Returns the sum of the primes of one block, with a single numpy reduction when numpy is installed"""
+    if np is not None:
+        offsets = np.flatnonzero(np.frombuffer(flags, dtype=np.uint8))
+        return int(offsets.sum()) + seg_lo * len(offsets)
+    return sum(it.compress(range(seg_lo, seg_lo + len(flags)), flags))
+
+
+def sieve_task(kind : str, lo : int, hi : int, segment_size : int, _base_primes : list[int] = None):
+    """
+    Sieves [lo, hi) with the base primes shared through parallel.WORKER_STATE, the worker side of the parallel mode.
+    Returns the number of primes for kind "count", their sum for "sum", both for "count_sum"
+    and an array('Q') of them for "primes"
+    """
+    if _base_primes is None:
+        _base_primes = parallel.WORKER_STATE["base_primes"]
+    blocks = segments(lo, hi, segment_size=segment_size, _base_primes=_base_primes)
+    if kind == "count":
+        return sum(flags.count(1) for _, flags in blocks)
+    if kind == "sum":
+        return sum(flags_sum(seg_lo, flags) for seg_lo, flags in blocks)
+    if kind == "count_sum":
+        count = total = 0
+        for seg_lo, flags in blocks:
+            count += flags.count(1)
+            total += flags_sum(seg_lo, flags)
+        return count, total
+    return array("Q", it.chain.from_iterable(it.compress(range(seg_lo, seg_lo + len(flags)), flags) for seg_lo, flags in blocks))
+
+
+def parallel_segments(kind : str, lo : int, hi : int, prime_sieve : PrimeSieve, workers : int, segment_size : int = None) -> Iterator:
+    """
+    Splits [lo, hi) into tasks of up to PARALLEL_BLOCKS blocks, sieves them with sieve_task on a pool of workers processes
+    and yields their results in increasing order of the tasks. The base primes are computed once and sent once to every worker.
+    """
+    lo = max(lo, 0)
+    if hi <= lo:
+        return
+    if segment_size is None:
+        segment_size = max(SEGMENT_SIZE, math.isqrt(hi))
+    task_size = max(segment_size, min(segment_size * PARALLEL_BLOCKS, -(-(hi - lo) // workers)))
+    tasks = ((kind, task_lo, min(task_lo + task_size, hi), segment_size) for task_lo in range(lo, hi, task_size))
+    state = {"base_primes": array("Q", base_primes(hi, prime_sieve))}
+    yield from parallel.imap_ordered(sieve_task, tasks, workers, state)
+
+
+def primes_in_range(lo : int, hi : int, prime_sieve : PrimeSieve = None, *, segment_size : int = None, workers : int = None) -> list[int]:
+    """Returns the list of primes p such that lo <= p < hi, sieved by workers processes if given"""
+    if parallel.check_workers(workers) > 1:
+        return list(it.chain.from_iterable(parallel_segments("primes", lo, hi, prime_sieve, workers, segment_size)))
+    return list(it.chain.from_iterable(
+        it.compress(range(seg_lo, seg_lo + len(flags)), flags)
+        for seg_lo, flags in segments(lo, hi, prime_sieve, segment_size=segment_size)))
+
+
+def count_primes_in_range(lo : int, hi : int, prime_sieve : PrimeSieve = None, *, segment_size : int = None, workers : int = None) -> int:
+    """Returns the number of primes p such that lo <= p < hi, sieved by workers processes if given"""
+    if parallel.check_workers(workers) > 1:
+        return sum(parallel_segments("count", lo, hi, prime_sieve, workers, segment_size))
+    return sum(flags.count(1) for _, flags in segments(lo, hi, prime_sieve, segment_size=segment_size))
+
+
+def sum_primes_in_range(lo : int, hi : int, prime_sieve : PrimeSieve = None, *, segment_size : int = None, workers : int = None) -> int:
+    """Returns the sum of primes p such that lo <= p < hi, sieved by workers processes if given"""
+    if parallel.check_workers(workers) > 1:
+        return sum(parallel_segments("sum", lo, hi, prime_sieve, workers, segment_size))
+    return sum(flags_sum(seg_lo, flags) for seg_lo, flags in segments(lo, hi, prime_sieve, segment_size=segment_size))
+
+
+def count_and_sum_primes_in_range(lo : int, hi : int, prime_sieve : PrimeSieve = None, *, segment_size : int = None, workers : int = None) -> tuple[int, int]:
+    """Returns the number and the sum of primes p such that lo <= p < hi in one sweep, sieved by workers processes if given"""
+    if parallel.check_workers(workers) > 1:
+        results = list(parallel_segments("count_sum", lo, hi, prime_sieve, workers, segment_size))
+        return sum(c for c, _ in results), sum(t for _, t in results)
+    lo = max(lo, 0)
+    if hi <= lo:
+        return 0, 0
+    if segment_size is None:
+        segment_size = max(SEGMENT_SIZE, math.isqrt(hi))
+    return sieve_task("count_sum", lo, hi, segment_size, base_primes(hi, prime_sieve))
+
+
+def prime_counts_at(points : list[int], lo : int, count_below_lo : int, prime_sieve : PrimeSieve = None, *, segment_size : int = None, workers : int = None, _base_primes : list[int] = None) -> list[int]:
+    """
+    Returns [pi(t) for t in points] in one sweep of the segmented sieve over [lo, max(points)].
+
+    Args:
+        points: increasing values, all >= lo - 1.
+        lo: where the sweep starts.
+        count_below_lo: pi(lo - 1), the number of primes below lo.
+        workers: number of processes sweeping consecutive parts of the range, whose counts are then accumulated in order.
+    """
+    counts = []
+    count = count_below_lo
+    i = 0
+    while i < len(points) and points[i] < lo:
+        counts.append(count)
+        i += 1
+    if i == len(points):
+        return counts
+
+    if parallel.check_workers(workers) > 1:
+        return counts + parallel_prime_counts_at(points[i:], lo, count, prime_sieve, workers, segment_size)
+
+    for seg_lo, flags in segments(lo, points[-1] + 1, prime_sieve, segment_size=segment_size, _base_primes=_base_primes):
+        pos = 0
+        seg_hi = seg_lo + len(flags)
+        while i < len(points) and points[i] < seg_hi:
+            end = points[i] - seg_lo + 1
+            count += flags.count(1, pos, end)
+            pos = end
+            counts.append(count)
+            i += 1
+        count += flags.count(1, pos)
+    return counts
+
+
+def counts_task(points : list[int], lo : int, hi : int, segment_size : int) -> list[int]:
+    """Worker side of parallel_prime_counts_at, the numbers of primes in [lo, t] for every t in points and in [lo, hi)"""
+    return prime_counts_at(points + [hi - 1], lo, 0, segment_size=segment_size, _base_primes=parallel.WORKER_STATE["base_primes"])
+
+
+def parallel_prime_counts_at(points : list[int], lo : int, count_below_lo : int, prime_sieve : PrimeSieve, workers : int, segment_size : int = None) -> list[int]:
+    """prime_counts_at with lo <= points[0], sweeping parts of [lo, points[-1]] as in parallel_segments"""
+    hi = points[-1] + 1
+    if segment_size is None:
+        segment_size = max(SEGMENT_SIZE, math.isqrt(hi))
+    task_size = max(segment_size, min(segment_size * PARALLEL_BLOCKS, -(-(hi - lo) // workers)))
+    tasks = []
+    for task_lo in range(lo, hi, task_size):
+        task_hi = min(task_lo + task_size, hi)
+        tasks.append((points[bisect.bisect_left(points, task_lo):bisect.bisect_left(points, task_hi)], task_lo, task_hi, segment_size))
+    state = {"base_primes": array("Q", base_primes(hi, prime_sieve))}
+
+    counts = []
+    count = count_below_lo
+    for task_counts in parallel.imap_ordered(counts_task, tasks, workers, state):
+        counts.extend(count + c for c in task_counts[:-1])
+        count += task_counts[-1]
+    return counts
+
+
+def flags_to_batch(seg_lo : int, flags : bytearray, batch : str):
+    """Converts the flags of one block to a chunk of its primes of the requested batch type"""
+    if batch == "numpy":
+        return np.flatnonzero(np.frombuffer(flags, dtype=np.uint8)).astype(np.uint64) + np.uint64(seg_lo)
+    return array("Q", it.compress(range(seg_lo, seg_lo + len(flags)), flags))
+
+
+def check_batch_mode(batch : str) -> None:
+    if batch not in BATCH_MODES:
+        raise Exception("Unknown batch mode '{}', expected one of {}".format(batch, BATCH_MODES))
+    if batch == "numpy" and np is None:
+        raise Exception("numpy batch mode was requested but numpy is not installed")
+
+
+def primerange(lo : int, hi : int, prime_sieve : PrimeSieve = None, *, batch : str = None, segment_size : int = None, workers : int = None) -> Iterator:
+    """
+    Lazily yields the primes p such that lo <= p < hi, in increasing order.
+
+    Args:
+        lo, hi: bounds of the range, lo inclusive, hi exclusive.
+        prime_sieve: optional sieve to take the base primes from.
+        batch: None to yield single ints, "array" to yield one array('Q') of primes per block,
+            "numpy" to yield one uint64 numpy array per block.
+        segment_size: numbers per block.
+        workers: number of processes sieving blocks ahead of the consumer. Batches then hold
+            the primes of up to PARALLEL_BLOCKS blocks.
+    """
+    check_batch_mode(batch)
+    if parallel.check_workers(workers) > 1:
+        for chunk in parallel_segments("primes", lo, hi, prime_sieve, workers, segment_size):
+            if batch is None:
+                yield from chunk
+            else:
+                yield np.frombuffer(chunk, dtype=np.uint64) if batch == "numpy" else chunk
+        return
+    for seg_lo, flags in segments(lo, hi, prime_sieve, segment_size=segment_size):
+        if batch is None:
+            yield from it.compress(range(seg_lo, seg_lo + len(flags)), flags)
+        else:
+            yield flags_to_batch(seg_lo, flags, batch)
+
+
+def iter_primes(start : int = 2, *, batch : str = None, segment_size : int = None) -> Iterator:
+    """
+    Lazily yields all primes p >= start, in increasing order, without an upper bound.
+    The base primes are recomputed with a doubled bound whenever a block needs larger ones.
+    See primerange for the meaning of batch and segment_size.
+    """
+    check_batch_mode(batch)
+    seg_lo = max(start, 0)
+    limit = 0
+    base = []
+    while True:
+        size = segment_size if segment_size is not None else max(SEGMENT_SIZE, math.isqrt(seg_lo))
+        seg_hi = seg_lo + size
+        needed = math.isqrt(seg_hi - 1)
+        if needed > limit:
+            limit = max(2 * limit, needed)
+            base = small_primes(limit)
+
+        for block_lo, flags in segments(seg_lo, seg_hi, segment_size=size, _base_primes=base):
+            if batch is None:
+                yield from it.compress(range(block_lo, block_lo + len(flags)), flags)
+            else:
+                yield flags_to_batch(block_lo, flags, batch)
+        seg_lo = seg_hi
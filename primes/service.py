@@ -0,0 +1,258 @@
+"""
+Asyncio front end answering primality and factorization queries. Queries are gathered into micro-batches
+over a short time window and every batch is computed by a pool of worker processes sharing one sieve.
+
+A newline delimited JSON protocol is served over TCP or a Unix socket, one request per line:
+    {"id": 1, "op": "check_prime", "n": 97}   ->   {"id": 1, "result": true}
+    {"id": 2, "op": "factorize", "n": 360}    ->   {"id": 2, "result": [[2, 3], [3, 2], [5, 1]]}
+Failed requests are answered with {"id": ..., "error": "..."}. Requests are pipelined, answers come in completion order.
+
+Run a server from the repository root:
+    python -m primes.service [--host HOST] [--port PORT | --unix PATH] [--sieve-size N] [--workers W]
+"""
+from typing import Iterator
+import argparse
+import asyncio
+import concurrent.futures
+import itertools as it
+import json
+import os
+
+from .primeSieve import PrimeSieve, np
+from .primes_utils import check_prime, check_prime_many
+from .factorization import get_prime_factors
+
+# operations answered by the service
+OPERATIONS = ("check_prime", "factorize")
+
+# defaults of PrimeService: sieve size, seconds a batch stays open, largest batch and most queries in flight
+SERVICE_SIEVE_SIZE = 10**7
+BATCH_WINDOW = 0.002
+MAX_BATCH = 1024
+MAX_PENDING = 1 << 14
+
+
+def run_batch(prime_sieve : PrimeSieve, op : str, values : list[int]) -> list:
+    """Worker side of PrimeService, answers one batch of queries of the same operation"""
+    if op == "check_prime":
+        if np is not None and max(values) < 1 << 63:
+            return check_prime_many(values, prime_sieve)
+        return [check_prime(v, prime_sieve) for v in values]
+    return [get_prime_factors(v, prime_sieve) for v in values]
+
+
+class PrimeService:
+    """
+    Answers check_prime and factorize queries with futures. Queries are queued and gathered into batches
+    of the same operation, closed after batch_window seconds or max_batch queries, and each batch is run
+    by run_batch on a pool of workers processes. The sieve is put in shared memory once, see PrimeSieve.to_shared,
+    so a batch only sends its values. At most max_pending queries are in flight, submit waits beyond that.
+
+    Use as an async context manager, or call start and close.
+    """
+    def __init__(self, sieve_size : int = SERVICE_SIEVE_SIZE, *, workers : int = None, layout : str = "spf",
+                 batch_window : float = BATCH_WINDOW, max_batch : int = MAX_BATCH, max_pending : int = MAX_PENDING):
+        self.sieve_size = sieve_size
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.layout = layout
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.sieve = None
+        self.pool = None
+        self.batcher = None
+
+    async def start(self) -> "PrimeService":
+        loop = asyncio.get_running_loop()
+        self.sieve = (await loop.run_in_executor(None, PrimeSieve, self.sieve_size, False, self.layout)).to_shared()
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.max_pending)
+        self.batches = set()
+        self.batcher = asyncio.create_task(self.batch_loop())
+        return self
+
+    async def close(self) -> None:
+        """Answers the queued queries, then stops the workers and releases the shared sieve"""
+        if self.batcher is None:
+            return
+        await self.queue.join()
+        self.batcher.cancel()
+        await asyncio.gather(self.batcher, *self.batches, return_exceptions=True)
+        self.batcher = None
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.shutdown) # waits for the workers off the event loop
+        self.sieve.close_shared()
+
+    async def __aenter__(self) -> "PrimeService":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def submit(self, op : str, n : int) -> asyncio.Future:
+        """Queues a query and returns the future of its answer, waiting first while max_pending queries are in flight"""
+        if op not in OPERATIONS:
+            raise Exception("Unknown operation '{}', expected one of {}".format(op, OPERATIONS))
+        if not isinstance(n, int) or isinstance(n, bool) or n < 0:
+            raise Exception("Queries must be non negative integers, got {!r}".format(n))
+        if self.batcher is None:
+            raise Exception("PrimeService is not started")
+        await self.slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda _: self.slots.release())
+        self.queue.put_nowait((op, n, future))
+        return future
+
+    async def check_prime(self, n : int) -> bool:
+        return await (await self.submit("check_prime", n))
+
+    async def factorize(self, n : int) -> list[tuple[int, int]]:
+        return await (await self.submit("factorize", n))
+
+    async def batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            for op, queries in self.group(batch):
+                task = asyncio.create_task(self.run(op, queries))
+                self.batches.add(task)
+                task.add_done_callback(self.batches.discard)
+
+    @staticmethod
+    def group(batch : list) -> Iterator[tuple[str, list]]:
+        for op in OPERATIONS:
+            queries = [q for q in batch if q[0] == op]
+            if queries:
+                yield op, queries
+
+    async def run(self, op : str, queries : list) -> None:
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.pool, run_batch, self.sieve, op, [n for _, n, _ in queries])
+        except Exception as e:
+            results = it.repeat(e)
+        for (_, _, future), result in zip(queries, results):
+            if not future.done():
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self.queue.task_done()
+
+
+async def handle_connection(service : PrimeService, reader : asyncio.StreamReader, writer : asyncio.StreamWriter) -> None:
+    """Serves one client of the line protocol, reading stops while the service has max_pending queries in flight"""
+    pending = set()
+
+    def answer(request_id, future : asyncio.Future) -> None:
+        pending.discard(future)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            response = {"id": request_id, "error": str(future.exception())}
+        else:
+            response = {"id": request_id, "result": future.result()}
+        writer.write(json.dumps(response).encode() + b"\n")
+
+    try:
+        while line := await reader.readline():
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get("id")
+                future = await service.submit(request["op"], request["n"])
+            except Exception as e:
+                writer.write(json.dumps({"id": request_id, "error": str(e)}).encode() + b"\n")
+                continue
+            pending.add(future)
+            future.add_done_callback(lambda f, request_id=request_id: answer(request_id, f))
+            await writer.drain()
+        if pending:
+            await asyncio.wait(pending)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(service : PrimeService, host : str = "127.0.0.1", port : int = 0, *, path : str = None) -> asyncio.Server:
+    """Starts serving the line protocol on a TCP port, or on the Unix socket path if given"""
+    handler = lambda reader, writer: handle_connection(service, reader, writer)
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path)
+    return await asyncio.start_server(handler, host, port)
+
+
+class PrimeClient:
+    """Pipelining client of the line protocol, every call returns when its own answer arrives"""
+    def __init__(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.ids = it.count()
+        self.waiting = {}
+        self.receiver = asyncio.create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, host : str = "127.0.0.1", port : int = None, *, path : str = None) -> "PrimeClient":
+        if path is not None:
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def receive(self) -> None:
+        while line := await self.reader.readline():
+            response = json.loads(line)
+            future = self.waiting.pop(response["id"], None)
+            if future is None or future.done():
+                continue
+            if "error" in response:
+                future.set_exception(Exception(response["error"]))
+            else:
+                future.set_result(response["result"])
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection closed by the server"))
+
+    async def request(self, op : str, n : int):
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request_id] = future
+        self.writer.write(json.dumps({"id": request_id, "op": op, "n": n}).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def check_prime(self, n : int) -> bool:
+        return await self.request("check_prime", n)
+
+    async def factorize(self, n : int) -> list[tuple[int, int]]:
+        return [tuple(f) for f in await self.request("factorize", n)]
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+        await asyncio.gather(self.receiver, return_exceptions=True)
+
+
+async def main(args) -> None:
+    async with PrimeService(args.sieve_size, workers=args.workers) as service:
+        server = await serve(service, args.host, args.port, path=args.unix)
+        print("serving on", ", ".join(str(s.getsockname()) for s in server.sockets), flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Primality and factorization query server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="serve on this Unix socket path instead of TCP")
+    parser.add_argument("--sieve-size", type=int, default=SERVICE_SIEVE_SIZE)
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to the number of cpus")
+    asyncio.run(main(parser.parse_args()))
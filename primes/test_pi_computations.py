@@ -1,8 +1,13 @@
 import unittest
 import math
+import os
+import tempfile
 
 import primes
 import primes.pi_computations as PC
+import primes.lucy as LH
+import itertools as it
+from primes.primeSieve import np
 
 class TestS(unittest.TestCase):
     def setUp(self) -> None:
@@ -23,6 +28,18 @@ class TestLegendreSum(unittest.TestCase):
         pl_sqr = primes.prime_list(prime_sieve=self.ps, upto=math.isqrt(self.N))
         pl = primes.prime_list(prime_sieve=self.ps, upto=self.N)
         self.assertTrue(True)
+
+    def test_phi_recursion_equal_to_inclusion_exclusion(self):
+        pl = primes.prime_list(prime_sieve=self.ps, upto=30)
+        for a in range(0, len(pl) + 1):
+            for n in range(0, self.N, 13):
+                self.assertEqual(PC.legendre_sum(n, a, pl), PC.legendre_sum_inclusion_exclusion(n, a, pl), msg="n={}, a={}".format(n, a))
+
+    def test_phi_cache_is_bounded(self):
+        pl = primes.prime_list(prime_sieve=self.ps, upto=self.N)
+        phi = PC.LegendrePhi(pl, cache_size=10)
+        self.assertEqual(phi(10**6, len(pl)), PC.LegendrePhi(pl)(10**6, len(pl)))
+        self.assertLessEqual(len(phi.cache), 10)
         
 class TestPiComputationMethods(unittest.TestCase):
     def setUp(self) -> None:
@@ -35,14 +52,148 @@ class TestPiComputationMethods(unittest.TestCase):
             res = PC.pi_from_list(n, prime_list=primes.prime_list(prime_sieve=ps, upto=n))
             self.assertEqual(res, correct_val)
 
+    def test_pi_brute(self):
+        for n, correct_val in self.test_values:
+            self.assertEqual(PC.pi_brute(n), correct_val, msg="failed on input {}".format(n))
+
+    def test_pi_legendre(self):
+        for n, correct_val in self.test_values:
+            self.assertEqual(PC.pi_legendre(n), correct_val, msg="failed on input {}".format(n))
+
     def test_pi_meissel(self):
         for n, correct_val in self.test_values:
             res = PC.pi_meissel(n)
             self.assertEqual(res, correct_val)
 
+    def test_pi_lehmer(self):
+        for n, correct_val in self.test_values + ((10**7, 664579),):
+            self.assertEqual(PC.pi_lehmer(n), correct_val, msg="failed on input {}".format(n))
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_pi_lmo(self):
+        for n, correct_val in self.test_values + ((10**8, 5761455), (10**9, 50847534)):
+            self.assertEqual(PC.pi_lmo(n), correct_val, msg="failed on input {}".format(n))
+        for n in range(PC.LMO_MIN, PC.LMO_MIN + 3000, 101):
+            self.assertEqual(PC.pi_lmo(n, alpha=3), PC.pi_brute(n), msg="failed on input {}".format(n))
+
+    def test_P2_P3_match_brute_force(self):
+        n = 3000
+        pl = primes.prime_list(None, upto=math.isqrt(n))
+        omega = {k: [p for p, e in primes.get_prime_factors(k) for _ in range(e)] for k in range(2, n+1)}
+        for a in range(0, 7):
+            rough = [f for f in omega.values() if a == 0 or f[0] > pl[a-1]]
+            self.assertEqual(PC.P2(n, a, pl), sum(1 for f in rough if len(f) == 2), msg="a={}".format(a))
+            if pl[a] ** 4 > n: # P3 reads pi from the list, so it needs p_(a+1) > n^(1/4)
+                self.assertEqual(PC.P3(n, a, pl), sum(1 for f in rough if len(f) == 3), msg="a={}".format(a))
+
+    def test_prime_pi_methods_agree(self):
+        for method in PC.PI_METHODS:
+            if method == "lmo" and np is None:
+                continue
+            for n, correct_val in self.test_values[:5]:
+                self.assertEqual(PC.prime_pi(n, method=method), correct_val, msg="method={}, n={}".format(method, n))
+        self.assertRaises(Exception, PC.prime_pi, 10, method="gauss")
+
     def test_pi_lucy_hedgehog(self):
         for n, correct_val in self.test_values:
             self.assertEqual(PC.pi_lucy_hedgehog(n), correct_val, msg="failed on input {}".format(n))
 
+    def test_workers_match_serial(self):
+        for n, correct_val in self.test_values[3:] + ((10**7, 664579),):
+            for method in PC.PI_PARALLEL_METHODS:
+                self.assertEqual(PC.prime_pi(n, method=method, workers=2), correct_val, msg="method={}, n={}".format(method, n))
+        n = 10**6
+        pl = primes.prime_list(None, upto=math.isqrt(n))
+        for a in (0, 5, 20, len(pl)):
+            self.assertEqual(PC.legendre_sum(n, a, pl, workers=3), PC.legendre_sum(n, a, pl), msg="a={}".format(a))
+        self.assertRaises(Exception, PC.prime_pi, 10**6, method="lmo", workers=2)
+
+class TestLucyTable(unittest.TestCase):
+    def setUp(self) -> None:
+        self.N = 5000
+        self.pl = primes.prime_list(None, upto=self.N)
+
+    def test_power_sums_match_prime_list(self):
+        engines = ("python", "numpy") if np is not None else ("python",)
+        for engine in engines:
+            for n in it.chain(range(0, 200), (999, 1000, self.N)):
+                for k in range(0, 4):
+                    expected = sum(p**k for p in self.pl if p <= n)
+                    self.assertEqual(LH.lucy_hedgehog(n, k, engine=engine), expected, msg="n={}, k={}, engine={}".format(n, k, engine))
+                    self.assertEqual(LH.lucy_hedgehog(n, k, mod=10007, engine=engine), expected % 10007, msg="n={}, k={}, engine={}".format(n, k, engine))
+
+    def test_table_holds_every_quotient(self):
+        table = LH.LucyTable(self.N, k=1)
+        for i in range(1, self.N + 1):
+            v = self.N // i
+            self.assertEqual(table[v], sum(p for p in self.pl if p <= v), msg="v={}".format(v))
+
+    def test_power_sum(self):
+        for k in range(0, 6):
+            for v in range(0, 50):
+                self.assertEqual(LH.power_sum(v, k), sum(n**k for n in range(1, v+1)))
+
+    def test_numpy_engine_refuses_unbounded_values(self):
+        self.assertRaises(Exception, LH.LucyTable, 100, engine="numpy", f=lambda p: p, prefix=lambda v: v*(v+1)//2)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_numpy_engine_recombines_values_beyond_int64(self):
+        for k in (3, 5):
+            crt_table = LH.LucyTable(10**5, k, engine="numpy")
+            self.assertEqual(list(crt_table.items()), list(LH.LucyTable(10**5, k, engine="python").items()), msg="k={}".format(k))
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_parallel_sieving_matches_serial(self):
+        parallel_min = LH.LUCY_PARALLEL_MIN
+        LH.LUCY_PARALLEL_MIN = 16 # sieve most primes in parallel even for small N
+        try:
+            for n, k, mod in ((self.N, 0, None), (10**6 + 3, 1, None), (10**6, 2, 10007), (10**5, 3, None)):
+                expected = list(LH.LucyTable(n, k, mod).items())
+                self.assertEqual(list(LH.LucyTable(n, k, mod, workers=3).items()), expected, msg="n={}, k={}, mod={}".format(n, k, mod))
+        finally:
+            LH.LUCY_PARALLEL_MIN = parallel_min
+
+class TestPrimeCheckpoints(unittest.TestCase):
+    def setUp(self) -> None:
+        self.N = 10**5
+        self.pl = primes.prime_list(None, upto=3 * self.N)
+
+    def reference(self, x):
+        selected = [p for p in self.pl if p <= x]
+        return len(selected), sum(selected)
+
+    def test_checkpoints_match_prime_list(self):
+        for workers in (None, 2):
+            table = primes.PrimeCheckpoints(self.N, 1000, workers=workers)
+            self.assertEqual(table.upto, self.N)
+            for k in range(0, self.N // 1000 + 1, 7):
+                self.assertEqual((table.counts[k], table.sums[k]), self.reference(k * 1000), msg="k={}, workers={}".format(k, workers))
+
+    def test_queries_match_prime_list(self):
+        table = primes.PrimeCheckpoints(self.N, 777)
+        for x in it.chain(range(0, 2000), range(self.N - 1000, self.N + 800, 13), (3 * self.N,)):
+            expected = self.reference(x)
+            self.assertEqual(table.pi(x), expected[0], msg="x={}".format(x))
+            self.assertEqual(table.prime_sum(x), expected[1], msg="x={}".format(x))
+
+    def test_cache_is_bounded(self):
+        table = primes.PrimeCheckpoints(10**4, 100, cache_size=10)
+        for x in range(1000, 1100):
+            table.pi(x)
+        self.assertLessEqual(len(table.cache), 10)
+        self.assertEqual(table.pi(1099), self.reference(1099)[0])
+
+    def test_save_load_roundtrip(self):
+        table = primes.PrimeCheckpoints(self.N, 1000)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "checkpoints")
+            table.save(path)
+            loaded = primes.PrimeCheckpoints.load(path)
+            with open(path, "r+b") as f:
+                f.write(b"NOTCHKPT")
+            self.assertRaises(Exception, primes.PrimeCheckpoints.load, path)
+        self.assertEqual((loaded.step, loaded.counts, loaded.sums), (table.step, table.counts, table.sums))
+        self.assertEqual(loaded.pi(54321), self.reference(54321)[0])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
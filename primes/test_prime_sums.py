@@ -0,0 +1,38 @@
+import unittest
+
+import primes
+import primes.prime_sums as PS
+
+class TestPrimeSum(unittest.TestCase):
+    def setUp(self) -> None:
+        self.N = 3000
+        self.pl = primes.prime_list(None, upto=self.N)
+
+    def test_brute_and_lucy_hedgehog_agree(self):
+        for n in (10, 100, 1000, self.N):
+            self.assertEqual(PS.brute(n), sum(p for p in self.pl if p <= n), msg="n={}".format(n))
+        for n in (2, 10, 100, 1000, self.N):
+            self.assertEqual(PS.lucy_Hedgehog_method(n), PS.brute(n), msg="n={}".format(n))
+            self.assertEqual(PS.lucy_Hedgehog_method(n, debug=True), PS.brute(n), msg="n={}".format(n))
+
+    def test_prime_sum_powers_and_modulus(self):
+        for n in range(0, self.N, 41):
+            ps = [p for p in self.pl if p <= n]
+            self.assertEqual(PS.prime_sum(n, k=0), len(ps))
+            self.assertEqual(PS.prime_sum(n), sum(ps))
+            self.assertEqual(PS.prime_sum(n, k=3, mod=1000003), sum(p**3 for p in ps) % 1000003)
+
+    def test_prime_sum_completely_multiplicative(self):
+        chi = lambda n: 0 if n % 2 == 0 else (1 if n % 4 == 1 else -1) # non-principal character mod 4
+        prefix = lambda v: (v + 3) // 4 - (v + 1) // 4
+        for n in range(0, self.N, 41):
+            expected = sum(chi(p) for p in self.pl if p <= n)
+            self.assertEqual(PS.prime_sum(n, f=chi, prefix=prefix), expected, msg="n={}".format(n))
+
+    def test_prime_sum_table(self):
+        table = PS.prime_sum(self.N, table=True)
+        for v, s in table.items():
+            self.assertEqual(s, sum(p for p in self.pl if p <= v), msg="v={}".format(v))
+
+if __name__ == "__main__":
+    unittest.main()
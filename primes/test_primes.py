@@ -1,10 +1,20 @@
+import concurrent.futures
 import math
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
 import unittest
 import functools as ft
 import itertools as it
 from typing import Sequence
 
 import primes
+import primes.segmented_sieve as SS
+import primes.factorization as FAC
+import primes.primes_utils as PU
+from primes.primeSieve import np
 
 class TestPrimeSieve(unittest.TestCase):
     def setUp(self) -> None:
@@ -41,6 +51,198 @@ class TestPrimeSieve(unittest.TestCase):
             self.assertTrue(n % self.ps.smallest_prime_factor(n) == 0)
 
 
+class TestPrimeSieveLayouts(unittest.TestCase):
+    def setUp(self) -> None:
+        self.TEST_UPTO = 10**3
+        self.reference = primes.PrimeSieve(self.TEST_UPTO, layout="list")
+
+    def test_layouts_agree_with_list_layout(self):
+        for layout in ("spf", "bitmap"):
+            ps = primes.PrimeSieve(self.TEST_UPTO, layout=layout)
+            for n in range(0, self.TEST_UPTO * 3):
+                self.assertEqual(ps.smallest_prime_factor(n), self.reference.smallest_prime_factor(n), msg="layout={}, n={}".format(layout, n))
+
+    def test_compact_layouts_are_smaller(self):
+        for layout in ("spf", "bitmap"):
+            ps = primes.PrimeSieve(self.TEST_UPTO, layout=layout)
+            self.assertLess(ps.nbytes(), self.reference.nbytes())
+
+    def test_unknown_layout_raises(self):
+        self.assertRaises(Exception, primes.PrimeSieve, 10, layout="dict")
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_numpy_engine_agrees_with_python_engine(self):
+        for layout in ("list", "spf", "bitmap"):
+            a = primes.PrimeSieve(self.TEST_UPTO, layout=layout, engine="python")
+            b = primes.PrimeSieve(self.TEST_UPTO, layout=layout, engine="numpy")
+            self.assertEqual(list(a.sieve), list(b.sieve), msg="layout={}".format(layout))
+
+
+class TestGrowableSieve(unittest.TestCase):
+    def setUp(self) -> None:
+        self.TEST_UPTO = 10**5
+        self.reference = primes.PrimeSieve(self.TEST_UPTO, layout="list")
+
+    def test_growth_matches_fixed_sieve(self):
+        engines = ("python", "numpy") if np is not None else ("python",)
+        for layout in ("list", "spf", "bitmap"):
+            for engine in engines:
+                ps = primes.PrimeSieve(100, layout=layout, engine=engine, growable=True)
+                for query in (101, 130, 1000, 70000, self.TEST_UPTO):
+                    self.assertEqual(ps.primes_upto(query), self.reference.primes_upto(query))
+                    self.assertGreaterEqual(ps.size, query)
+                    if 2 * ps.size <= self.TEST_UPTO:
+                        self.assertEqual(ps.is_composite(2 * ps.size - 1), self.reference.is_composite(2 * ps.size - 1))
+                    for x in range(2, ps.size + 1, 7):
+                        self.assertEqual(ps.smallest_prime_factor(x), self.reference.smallest_prime_factor(x), msg="layout={}, engine={}, x={}".format(layout, engine, x))
+
+    def test_memory_ceiling(self):
+        ps = primes.PrimeSieve(10, growable=True, max_bytes=1000)
+        self.assertTrue(ps.covers(900))
+        self.assertFalse(ps.covers(10**6))
+        self.assertLessEqual(ps.nbytes(), 1000)
+        self.assertTrue(primes.check_prime(10**9 + 7, ps))
+        self.assertEqual(primes.get_prime_factors(2**20 * 3, ps), [(2, 20), (3, 1)])
+
+    def test_far_queries_do_not_grow(self):
+        ps = primes.PrimeSieve(1000, growable=True)
+        self.assertTrue(primes.check_prime(10**8 + 7, ps))
+        self.assertEqual(primes.get_prime_factors((10**9 + 7) * 12, ps), [(2, 2), (3, 1), (10**9 + 7, 1)])
+        self.assertEqual(FAC.factorize(10**6 * 999983, ps), [(2, 6), (5, 6), (999983, 1)])
+        self.assertEqual(primes.check_prime_many([10**8 + 7, 7], ps), [True, True])
+        self.assertEqual(ps.smallest_prime_factor(10**5 + 3), 10**5 + 3)
+        self.assertRaises(Exception, ps.is_composite, 10**5)
+        self.assertEqual(ps.size, 1000)
+        self.assertEqual(ps.smallest_prime_factor(1501), 19)
+        self.assertEqual(ps.size, 2000)
+
+    def test_fixed_sieve_does_not_grow(self):
+        ps = primes.PrimeSieve(100)
+        self.assertFalse(ps.covers(101))
+        self.assertRaises(Exception, ps.is_composite, 101)
+
+
+class TestPrimeSieveFiles(unittest.TestCase):
+    def setUp(self) -> None:
+        self.TEST_UPTO = 10**4
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_save_load_roundtrip(self):
+        for layout in ("list", "spf", "bitmap"):
+            ps = primes.PrimeSieve(self.TEST_UPTO, layout=layout)
+            path = os.path.join(self.dir.name, layout)
+            ps.save(path)
+            for mmap in (True, False):
+                loaded = primes.PrimeSieve.load(path, mmap=mmap, verify=True)
+                self.assertEqual(loaded.size, ps.size)
+                for n in range(0, self.TEST_UPTO * 3, 7):
+                    self.assertEqual(loaded.smallest_prime_factor(n), ps.smallest_prime_factor(n), msg="layout={}, mmap={}, n={}".format(layout, mmap, n))
+
+    def test_save_loaded_sieve_roundtrip(self):
+        for layout in ("list", "spf", "bitmap"):
+            ps = primes.PrimeSieve(self.TEST_UPTO, layout=layout)
+            path = os.path.join(self.dir.name, layout)
+            ps.save(path)
+            for mmap in (True, False):
+                primes.PrimeSieve.load(path, mmap=mmap).save(path + ".copy")
+                loaded = primes.PrimeSieve.load(path + ".copy", mmap=mmap, verify=True)
+                self.assertEqual(loaded.primes_upto(self.TEST_UPTO), ps.primes_upto(self.TEST_UPTO), msg="layout={}, mmap={}".format(layout, mmap))
+
+    def test_load_rejects_corrupted_files(self):
+        path = os.path.join(self.dir.name, "sieve")
+        primes.PrimeSieve(self.TEST_UPTO).save(path)
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\xff")
+        self.assertRaises(Exception, primes.PrimeSieve.load, path, mmap=False)
+        self.assertRaises(Exception, primes.PrimeSieve.load, path, verify=True)
+
+        with open(path, "r+b") as f:
+            f.write(b"NOTSIEVE")
+        self.assertRaises(Exception, primes.PrimeSieve.load, path)
+
+
+def shared_sieve_factors(prime_sieve, xs):
+    return [prime_sieve.smallest_prime_factor(x) for x in xs]
+
+
+class TestSharedSieve(unittest.TestCase):
+    def setUp(self) -> None:
+        self.TEST_UPTO = 10**4
+
+    def test_shared_sieve_in_process_pool(self):
+        for layout in ("list", "spf", "bitmap"):
+            ps = primes.PrimeSieve(self.TEST_UPTO, layout=layout)
+            shared = ps.to_shared()
+            try:
+                self.assertLess(len(pickle.dumps(shared)), 200)
+                chunks = [range(i, self.TEST_UPTO + 1, 101) for i in range(4)]
+                with concurrent.futures.ProcessPoolExecutor(2) as pool:
+                    results = list(pool.map(shared_sieve_factors, [shared] * len(chunks), chunks))
+                for chunk, result in zip(chunks, results):
+                    self.assertEqual(result, shared_sieve_factors(ps, chunk), msg="layout={}".format(layout))
+            finally:
+                shared.close_shared()
+
+    def test_share_loaded_sieve_in_process_pool(self):
+        with tempfile.TemporaryDirectory() as d:
+            for layout in ("spf", "bitmap"):
+                ps = primes.PrimeSieve(self.TEST_UPTO, layout=layout)
+                path = os.path.join(d, layout)
+                ps.save(path)
+                shared = primes.PrimeSieve.load(path).to_shared()
+                reshared = shared.to_shared()
+                try:
+                    chunks = [range(i, self.TEST_UPTO + 1, 101) for i in range(4)]
+                    with concurrent.futures.ProcessPoolExecutor(2) as pool:
+                        results = list(pool.map(shared_sieve_factors, [shared, reshared] * 2, chunks))
+                    for chunk, result in zip(chunks, results):
+                        self.assertEqual(result, shared_sieve_factors(ps, chunk), msg="layout={}".format(layout))
+                finally:
+                    reshared.close_shared()
+                    shared.close_shared()
+
+    def test_close_shared_removes_segment(self):
+        shared = primes.PrimeSieve(self.TEST_UPTO).to_shared()
+        name = shared._shm.name
+        attached = primes.PrimeSieve.attach_shared(name)
+        self.assertEqual(attached.primes_upto(100), shared.primes_upto(100))
+        attached.close_shared()
+        shared.close_shared()
+        self.assertRaises(FileNotFoundError, primes.PrimeSieve.attach_shared, name)
+        shared.close_shared()
+
+    def test_segment_survives_attach_from_another_process(self):
+        shared = primes.PrimeSieve(self.TEST_UPTO).to_shared()
+        name = shared._shm.name
+        script = "import primes; print(primes.PrimeSieve.attach_shared({!r}).primes_upto(30))".format(name)
+        out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(out.stdout.strip(), str(shared.primes_upto(30)))
+        self.assertNotIn("leaked", out.stderr)
+        attached = primes.PrimeSieve.attach_shared(name)
+        self.assertEqual(attached.primes_upto(100), shared.primes_upto(100))
+        attached.close_shared()
+        shared.close_shared()
+
+    def test_close_shared_after_segment_removed(self):
+        shared = primes.PrimeSieve(self.TEST_UPTO).to_shared()
+        shared._shm.unlink()
+        shared.close_shared()
+        shared.close_shared()
+        self.assertRaises(Exception, primes.PrimeSieve(10).close_shared)
+
+    def test_mmap_sieve_pickles_as_path(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "sieve")
+            primes.PrimeSieve(self.TEST_UPTO).save(path)
+            loaded = primes.PrimeSieve.load(path)
+            self.assertEqual(pickle.loads(pickle.dumps(loaded)).primes_upto(self.TEST_UPTO), loaded.primes_upto(self.TEST_UPTO))
+
+
 class TestPrimeFactoriztions(unittest.TestCase):
     def setUp(self):
         self.TEST_UPTO = 10**3
@@ -109,8 +311,119 @@ class TestPrimeFactoriztions(unittest.TestCase):
         
         for n in range(2, self.TEST_UPTO):
             self.assertEqual(n, revert_factorization(primes.get_prime_factors(n, prime_sieve=self.ps)), msg="reverting factorization must ")
+
+    def test_get_prime_factors_agrees_with_trial_division(self):
+        for n in range(0, 5 * self.TEST_UPTO, 3):
+            expected = FAC.get_prime_factorization_no_sieve(n)
+            self.assertEqual(primes.get_prime_factors(n), expected, msg="n={}".format(n))
+            self.assertEqual(primes.get_prime_factors(n, self.ps), expected, msg="n={}".format(n))
+
+    def test_get_prime_factors_large_semiprimes(self):
+        p, q = 4294967291, 4294967279
+        self.assertEqual(primes.get_prime_factors(p * q), [(q, 1), (p, 1)])
+        self.assertEqual(primes.get_prime_factors(12 * p * p * q, self.ps), [(2, 2), (3, 1), (q, 1), (p, 2)])
+        self.assertEqual(primes.get_prime_factors((2**61 - 1) * (10**12 + 39)), [(10**12 + 39, 1), (2**61 - 1, 1)])
+
+    def test_factorize_range_matches_get_prime_factors(self):
+        for lo, hi, sieve in ((1, self.TEST_UPTO, self.ps), (1, self.TEST_UPTO, None), (10**9, 10**9 + 500, None), (500, 2000, self.ps)):
+            offsets, fprimes, exponents = primes.factorize_range(lo, hi, sieve)
+            self.assertEqual(len(offsets), hi - lo + 1)
+            for i, n in enumerate(range(lo, hi)):
+                factors = list(zip(fprimes[offsets[i]:offsets[i+1]], exponents[offsets[i]:offsets[i+1]]))
+                self.assertEqual(factors, FAC.get_prime_factorization_no_sieve(n), msg="n={}".format(n))
+
+    def test_factorize_range_on_growable_sieve(self):
+        ps = primes.PrimeSieve(self.TEST_UPTO, growable=True)
+        offsets, fprimes, exponents = primes.factorize_range(self.TEST_UPTO - 100, 3 * self.TEST_UPTO, ps)
+        for i, n in enumerate(range(self.TEST_UPTO - 100, 3 * self.TEST_UPTO)):
+            factors = list(zip(fprimes[offsets[i]:offsets[i+1]], exponents[offsets[i]:offsets[i+1]]))
+            self.assertEqual(factors, primes.get_prime_factors(n, ps), msg="n={}".format(n))
+        self.assertEqual(ps.size, self.TEST_UPTO)
+
+    def test_ecm_stage1_finds_factor(self):
+        n = 1000000007 * 998244353 * (2**61 - 1)
+        d = FAC.ecm_stage1(n, 11000, curves=50)
+        self.assertIsNotNone(d)
+        self.assertTrue(1 < d < n and n % d == 0)
     
 
+class TestSegmentedSieve(unittest.TestCase):
+    def setUp(self) -> None:
+        self.TEST_UPTO = 10**4
+        self.ps = primes.PrimeSieve(self.TEST_UPTO)
+        self.reference = [p for p in range(self.TEST_UPTO) if primes.check_prime(p, self.ps)]
+
+    def test_primes_in_range_matches_sieve(self):
+        for lo, hi in ((0, 2), (0, 3), (2, 100), (90, 97), (97, 98), (1000, self.TEST_UPTO)):
+            expected = [p for p in self.reference if lo <= p < hi]
+            self.assertEqual(SS.primes_in_range(lo, hi), expected, msg="lo={}, hi={}".format(lo, hi))
+            self.assertEqual(SS.primes_in_range(lo, hi, segment_size=37), expected, msg="lo={}, hi={}".format(lo, hi))
+
+    def test_count_and_sum_in_range(self):
+        self.assertEqual(SS.count_primes_in_range(0, self.TEST_UPTO, segment_size=1000), len(self.reference))
+        self.assertEqual(SS.sum_primes_in_range(0, self.TEST_UPTO, segment_size=1000), sum(self.reference))
+
+    def test_range_beyond_sieve_size_squared(self):
+        lo = 10**12
+        window = SS.primes_in_range(lo, lo + 1000, primes.PrimeSieve(10))
+        self.assertEqual(window[:3], [1000000000039, 1000000000061, 1000000000063])
+
+    def test_primerange_streams_same_primes(self):
+        self.assertEqual(list(primes.primerange(0, self.TEST_UPTO, segment_size=100)), self.reference)
+        chunks = list(primes.primerange(0, self.TEST_UPTO, segment_size=100, batch="array"))
+        self.assertEqual(list(it.chain.from_iterable(chunks)), self.reference)
+
+    def test_iter_primes_is_unbounded_and_starts_at_offset(self):
+        self.assertEqual(list(it.islice(primes.iter_primes(segment_size=50), len(self.reference))), self.reference)
+        tail = [p for p in self.reference if p >= 5000]
+        self.assertEqual(list(it.islice(primes.iter_primes(5000), len(tail))), tail)
+
+    def test_unknown_batch_mode_raises(self):
+        self.assertRaises(Exception, next, primes.primerange(0, 10, batch="list"))
+
+    def test_prime_list_upto_beyond_sieve_size(self):
+        self.assertEqual(primes.prime_list(primes.PrimeSieve(10), upto=self.TEST_UPTO-1), self.reference)
+
+    def test_parallel_mode_matches_serial(self):
+        for lo, hi in ((0, 2), (90, 97), (0, self.TEST_UPTO), (10**9, 10**9 + 5000)):
+            msg = "lo={}, hi={}".format(lo, hi)
+            expected = SS.primes_in_range(lo, hi)
+            self.assertEqual(SS.primes_in_range(lo, hi, segment_size=300, workers=2), expected, msg=msg)
+            self.assertEqual(SS.count_primes_in_range(lo, hi, segment_size=300, workers=2), len(expected), msg=msg)
+            self.assertEqual(SS.sum_primes_in_range(lo, hi, segment_size=300, workers=2), sum(expected), msg=msg)
+            self.assertEqual(list(primes.primerange(lo, hi, segment_size=300, workers=2)), expected, msg=msg)
+        self.assertEqual(primes.pi_brute(self.TEST_UPTO, workers=2), len(self.reference))
+        self.assertRaises(Exception, SS.count_primes_in_range, 0, 10, workers=0)
+
+
+class TestArithmeticFunctions(unittest.TestCase):
+    def setUp(self) -> None:
+        self.N = 2000
+        self.tables = primes.arithmetic_tables(self.N)
+
+    def reference(self, n : int) -> dict:
+        factors = FAC.get_prime_factorization_no_sieve(n)
+        return {
+            "phi": sum(1 for k in range(1, n+1) if math.gcd(k, n) == 1),
+            "mu": 0 if any(e > 1 for _, e in factors) else (-1)**len(factors),
+            "tau": sum(1 for d in range(1, n+1) if n % d == 0),
+            "sigma": sum(d for d in range(1, n+1) if n % d == 0),
+            "omega": len(factors),
+        }
+
+    def test_tables_match_definitions(self):
+        for n in it.chain(range(1, 200), range(200, self.N+1, 37)):
+            for f, value in self.reference(n).items():
+                self.assertEqual(self.tables[f][n], value, msg="{}({})".format(f, n))
+
+    def test_range_tables_match_full_tables(self):
+        lo, hi = 1500, self.N + 1
+        for sieve in (None, primes.PrimeSieve(self.N)):
+            ranged = primes.arithmetic_tables_range(lo, hi, sieve)
+            for f, table in ranged.items():
+                self.assertEqual(list(table), list(self.tables[f][lo:hi]), msg=f)
+
+
 class TestPrimeUtils(unittest.TestCase):
     def setUp(self) -> None:
         self.ps = primes.PrimeSieve(10000)
@@ -130,6 +443,48 @@ class TestPrimeUtils(unittest.TestCase):
             for b in range(a, 50):
                 self.assertFalse(primes.check_prime(a*b, self.ps), msg="check prime must be false for composite numbers")
 
+    def test_check_prime_beyond_sieve(self):
+        small = primes.PrimeSieve(10)
+        for n in range(0, 2000):
+            self.assertEqual(primes.check_prime(n, small), primes.check_prime(n, self.ps), msg="n={}".format(n))
+        self.assertTrue(primes.check_prime(999999999999999989, small), msg="largest 18 digit prime")
+        self.assertFalse(primes.check_prime(3825123056546413051, small), msg="strong pseudoprime to bases 2..23")
+        self.assertTrue(primes.check_prime(2**127 - 1))
+        self.assertFalse(primes.check_prime((2**61 - 1) * (2**89 - 1)))
+
+    def test_check_prime_many_matches_check_prime(self):
+        values = list(range(0, 3000, 7)) + [999999999999999989, 3825123056546413051, 4759123141, 2147483647]
+        expected = [primes.check_prime(v, self.ps) for v in values]
+        self.assertEqual(primes.check_prime_many(values, self.ps), expected)
+        self.assertEqual(primes.check_prime_many(values), expected)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_check_prime_many_numpy(self):
+        values = np.arange(0, 20000, dtype=np.int64)
+        expected = [primes.check_prime(int(v), self.ps) for v in values]
+        for layout in ("list", "spf", "bitmap"):
+            ps = primes.PrimeSieve(1000, layout=layout)
+            mask = primes.check_prime_many(values, ps)
+            self.assertIsInstance(mask, np.ndarray)
+            self.assertEqual(mask.tolist(), expected, msg="layout={}".format(layout))
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_check_prime_many_64_bit(self):
+        values = list(range(2**64 - 2000, 2**64)) + list(range(2**63 - 1000, 2**63 + 1000)) + list(range(2**32 - 500, 2**32 + 500))
+        values += [3825123056546413051, (2**31 - 1) * (2**32 - 5), 4294967291 * 4294967279, 2**61 - 1]
+        expected = [primes.check_prime(v) for v in values]
+        self.assertEqual(primes.check_prime_many(np.array(values, dtype=np.uint64)).tolist(), expected)
+        self.assertEqual(primes.check_prime_many(values + [2**89 - 1, 2**89 + 1]), expected + [True, False])
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_check_prime_many_mixed_list(self):
+        self.assertEqual(primes.check_prime_many([5, 2**64 - 59]), [True, True])
+        values = [2**63 + i for i in range(2000)] + [3, 0, 10**6 + 3]
+        self.assertEqual(primes.check_prime_many(values), [primes.check_prime(v) for v in values])
+        self.assertEqual(primes.check_prime_many(values, self.ps), [primes.check_prime(v) for v in values])
+        self.assertRaises(Exception, primes.check_prime_many, [3.0, 5])
+        self.assertRaises(Exception, primes.check_prime_many, np.array([3.0, 5.0]))
+
     def test_prime_list(self):
         for n in range(2,1000, 17):
             lst = primes.prime_list(self.ps, upto=n)
@@ -140,6 +495,35 @@ class TestPrimeUtils(unittest.TestCase):
         list2 = primes.prime_list(self.ps, n=50)
         self.assertEqual(list1, list2)
 
+    def test_nth_prime_beyond_sieve_window(self):
+        reference = SS.primes_in_range(2, 3 * 10**6)
+        for n in (82025, 100000, 150001, len(reference)):
+            self.assertEqual(primes.nth_prime(n), reference[n-1], msg="n={}".format(n))
+        self.assertEqual(primes.nth_prime(10**7), 179424673)
+        self.assertEqual(primes.prime_list(None, n=len(reference)), reference)
+        self.assertRaises(Exception, primes.nth_prime, 0)
+
+    def test_nth_prime_bounds(self):
+        reference = SS.primes_in_range(2, 2 * 10**6)
+        for n in it.chain(range(1, 1000), range(1000, len(reference) + 1, 997)):
+            lower, upper = PU.nth_prime_bounds(n)
+            self.assertTrue(lower <= reference[n-1] <= upper, msg="n={}".format(n))
+
+    def test_next_and_prev_prime_agree_with_prime_list(self):
+        plist = primes.prime_list(self.ps, upto=3000)
+        small = primes.PrimeSieve(100)
+        for i in range(1, len(plist) - 1):
+            for sieve in (None, small, self.ps):
+                self.assertEqual(primes.next_prime(plist[i], sieve), plist[i+1], msg="n={}".format(plist[i]))
+                self.assertEqual(primes.next_prime(plist[i] - 1, sieve), plist[i], msg="n={}".format(plist[i] - 1))
+                self.assertEqual(primes.prev_prime(plist[i], sieve), plist[i-1], msg="n={}".format(plist[i]))
+                self.assertEqual(primes.prev_prime(plist[i] + 1, sieve), plist[i], msg="n={}".format(plist[i] + 1))
+        self.assertRaises(Exception, primes.prev_prime, 2)
+
+    def test_next_and_prev_prime_large(self):
+        self.assertEqual(primes.next_prime(10**18, self.ps), 10**18 + 3)
+        self.assertEqual(primes.prev_prime(10**18, self.ps), 10**18 - 11)
+
     def test_next_prime_brute(self):
         for n in it.chain(range(1,100), range(100, 1000, 37)):
             p = primes.next_prime(n, self.ps)
@@ -147,5 +531,39 @@ class TestPrimeUtils(unittest.TestCase):
             for i in range(n+1, p):
                 self.assertFalse(primes.check_prime(i, self.ps))
 
+class TestInstrumentation(unittest.TestCase):
+    def test_counts_paths_only_while_enabled(self):
+        ps = primes.PrimeSieve(100)
+        primes.check_prime(97, ps)
+        with primes.collect_stats() as stats:
+            primes.PrimeSieve(1000)
+            ps.smallest_prime_factor(91)
+            ps.smallest_prime_factor(9991)
+            primes.check_prime(97, ps)
+            primes.check_prime(10**9 + 7, ps)
+            primes.get_prime_factors(2**5 * 1000003 * 1000033)
+        primes.check_prime(97, ps)
+
+        self.assertEqual(stats.counters["sieve.spf.table"], 1)
+        self.assertEqual(stats.counters["sieve.spf.trial_division"], 1)
+        self.assertEqual(stats.counters["check_prime.table"], 1)
+        self.assertEqual(stats.counters["check_prime.probable_prime"], 1)
+        self.assertEqual(stats.counters["factorize.trial_division"], 5)
+        self.assertEqual(stats.counters["factorize.prime"], 2)
+        self.assertEqual(stats.calls["sieve.build"], 1)
+        self.assertEqual(stats.calls["factorize.rho"], 1)
+        self.assertIn("sieve.build", stats.as_dict()["timers"])
+        self.assertIn("check_prime.table", stats.report())
+
+    def test_nested_blocks_restore_previous_stats(self):
+        with primes.collect_stats() as outer:
+            with primes.collect_stats() as inner:
+                primes.prime_pi(10**4)
+            primes.prime_pi(10**6, method="meissel")
+        self.assertEqual(inner.calls["prime_pi.brute"], 1)
+        self.assertEqual(outer.calls["prime_pi.meissel"], 1)
+        self.assertNotIn("prime_pi.brute", outer.calls)
+        self.assertIsNone(primes.instrumentation.STATS)
+
 if __name__ == "__main__":
     unittest.main()
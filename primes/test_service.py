@@ -0,0 +1,53 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import primes
+from primes.service import PrimeService, PrimeClient, serve
+
+
+class TestPrimeService(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.service = await PrimeService(10**4, workers=2, max_batch=64, max_pending=100).start()
+
+    async def asyncTearDown(self) -> None:
+        await self.service.close()
+
+    async def test_batched_answers_match_direct_calls(self):
+        values = list(range(9000, 11000)) + [2**61 - 1, 2**64 + 13]
+        answers = await asyncio.gather(*(self.service.check_prime(v) for v in values))
+        self.assertEqual(answers, [primes.check_prime(v) for v in values])
+
+        values = list(range(0, 300)) + [2**64 + 1, 10**12 + 39]
+        answers = await asyncio.gather(*(self.service.factorize(v) for v in values))
+        self.assertEqual(answers, [primes.get_prime_factors(v) if v >= 2 else [] for v in values])
+
+    async def test_invalid_queries_raise(self):
+        with self.assertRaises(Exception):
+            await self.service.check_prime(-1)
+        with self.assertRaises(Exception):
+            await self.service.submit("sigma", 10)
+
+    async def test_server_and_client(self):
+        with tempfile.TemporaryDirectory() as d:
+            servers = [await serve(self.service), await serve(self.service, path=os.path.join(d, "socket"))]
+            clients = [await PrimeClient.connect(port=servers[0].sockets[0].getsockname()[1]),
+                       await PrimeClient.connect(path=os.path.join(d, "socket"))]
+            try:
+                for client in clients:
+                    answers = await asyncio.gather(*(client.check_prime(v) for v in range(200)))
+                    self.assertEqual(answers, [primes.check_prime(v) for v in range(200)])
+                    self.assertEqual(await client.factorize(2**67 - 1), [(193707721, 1), (761838257287, 1)])
+                    with self.assertRaises(Exception):
+                        await client.request("factorize", "360")
+            finally:
+                for client in clients:
+                    await client.close()
+                for server in servers:
+                    server.close()
+                    await server.wait_closed()
+
+
+if __name__ == "__main__":
+    unittest.main()